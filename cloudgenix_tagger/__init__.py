@@ -13,6 +13,15 @@ import json
 import re
 from copy import deepcopy
 import csv
+import hashlib
+import fnmatch
+from multiprocessing.pool import ThreadPool
+import time
+import threading
+import math
+import bisect
+import gzip
+import io
 
 ####
 #
@@ -82,9 +91,11 @@ except ImportError:
 if sys.version_info < (3,):
     text_type = unicode
     binary_type = str
+    import Queue as queue
 else:
     text_type = str
     binary_type = bytes
+    import queue
 
 
 ####
@@ -95,6 +106,42 @@ else:
 
 SUPPORTED_OBJECTS = ['sites', 'elements', 'interfaces', 'circuitcatagories']
 
+MATCH_TYPES = ['regex', 'exact', 'prefix', 'glob']
+
+# accepted ID column names in --ids files, in order of preference.
+ID_COLUMNS = {
+    'sites': ['id', 'site_id'],
+    'elements': ['id', 'element_id'],
+    'interfaces': ['id', 'interface_id'],
+    'circuitcatagories': ['id', 'circuitcatagory_id']
+}
+
+# default concurrent API workers for ID based (targeted) mode.
+DEFAULT_WORKERS = 8
+
+# default retry rounds for failed tag changes.
+DEFAULT_RETRIES = 2
+
+# where tag changes that still fail after retries are saved if --failures is not used. Formatted with a timestamp.
+DEFAULT_FAILURES = "do_tags_failures_{0}.csv"
+
+# hedged GETs wait for this latency percentile, once this many samples are available.
+DEFAULT_HEDGE_PERCENTILE = 95
+DEFAULT_HEDGE_MIN_SAMPLES = 20
+
+# snapshot file format version.
+SNAPSHOT_VERSION = 1
+
+# minimum seconds between progress bar redraws/JSON progress events.
+DEFAULT_PROGRESS_INTERVAL = 0.5
+
+# default session cache location and lifetime (seconds), if --session-cache is used.
+DEFAULT_SESSION_CACHE = "~/.cloudgenix_tagger_session.json"
+DEFAULT_SESSION_CACHE_TTL = 3600
+
+# characters that make a regex more than a plain literal.
+REGEX_SPECIAL_CHARS = ".^$*+?{}[]|()"
+
 GLOBAL_MY_SCRIPT_NAME = "CloudGenix Tagger"
 GLOBAL_MY_SCRIPT_VERSION = "v1.0.0"
 
@@ -222,6 +269,59 @@ def remove_tags(remove_tag_list, cgx_dict):
     return new_cgx_dict
 
 
+def replace_tags(tag_map, cgx_dict):
+    """
+    This function looks at a CloudGenix config object, and replaces tags in one change.
+    :param tag_map: Dict of old tag -> new tag.
+    :param cgx_dict: CloudGenix config dict, expects "tags" keys supported in root.
+    :return: CloudGenix config dict with old tags replaced by new tags.
+    """
+    old_tags = [tag for tag in extract_tags(cgx_dict) if tag in tag_map]
+    if not old_tags:
+        # nothing to replace.
+        return deepcopy(cgx_dict)
+
+    new_cgx_dict = remove_tags(old_tags, cgx_dict)
+    return put_tags([tag_map[tag] for tag in old_tags], new_cgx_dict)
+
+
+def load_tag_map(filename):
+    """
+    Load a tag rename mapping from a .csv file with 'old tag,new tag' rows.
+    :param filename: Name of .csv file
+    :return: Dict of old tag -> new tag.
+    """
+    tag_map = {}
+
+    with open(filename, "r") as csv_input:
+        for line_number, row in enumerate(csv.reader(csv_input), 1):
+            if not row or not "".join(row).strip():
+                # skip blank lines
+                continue
+            if len(row) != 2:
+                throw_error("'{0}' line {1}: expected 'old tag,new tag', got {2}.".format(filename, line_number, row))
+            old_tag, new_tag = [text_type(tag).strip() for tag in row]
+            if old_tag in tag_map and tag_map[old_tag] != new_tag:
+                throw_error("'{0}' line {1}: tag '{2}' mapped more than once.".format(filename, line_number, old_tag))
+            tag_map[old_tag] = new_tag
+
+    if not tag_map:
+        throw_error("'{0}' has no tag mappings.".format(filename))
+
+    return tag_map
+
+
+def describe_tag(the_tag):
+    """
+    Get display text for the tag being worked on.
+    :param the_tag: Tag text, or dict of old tag -> new tag for replace.
+    :return: Text suitable for the 'Tag' output column.
+    """
+    if isinstance(the_tag, dict):
+        return ", ".join(["{0} -> {1}".format(old_tag, new_tag) for old_tag, new_tag in sorted(the_tag.items())])
+    return the_tag
+
+
 def extract_items(resp_object, error_label=None):
     """
     Extract
@@ -249,6 +349,91 @@ def extract_items(resp_object, error_label=None):
             return []
 
 
+def parse_shard(shard_string):
+    """
+    Parse a shard specification string.
+    :param shard_string: Shard in 'i/N' format, where i is 1-based index of this shard and N is total shard count.
+    :return: Tuple of shard index (1-based) and shard count.
+    """
+    try:
+        index_text, count_text = text_type(shard_string).split("/")
+        index = int(index_text)
+        count = int(count_text)
+    except ValueError:
+        throw_error("Invalid shard '{0}'. Must be in 'i/N' format, ex. '1/4'.".format(shard_string))
+        return None
+
+    if count < 1 or not 1 <= index <= count:
+        throw_error("Invalid shard '{0}'. Index must be between 1 and {1}.".format(shard_string, count))
+
+    return index, count
+
+
+def in_shard(object_id, shard=None):
+    """
+    Deterministically check if an object ID belongs to a shard. Uses a stable hash, so the same ID always lands in
+    the same shard across processes and hosts.
+    :param object_id: CloudGenix object ID
+    :param shard: Optional tuple of shard index (1-based) and shard count, as returned by parse_shard()
+    :return: Bool, True if object belongs to shard (or no shard specified).
+    """
+    if shard is None:
+        return True
+
+    index, count = shard
+    digest = hashlib.md5(text_type(object_id).encode('utf-8')).hexdigest()
+    return int(digest, 16) % count == index - 1
+
+
+def shard_items(items_list, shard=None):
+    """
+    Filter a list of CloudGenix config dicts down to the ones that belong to a shard.
+    :param items_list: List of CloudGenix config dicts
+    :param shard: Optional tuple of shard index (1-based) and shard count, as returned by parse_shard()
+    :return: List of CloudGenix config dicts in shard.
+    """
+    if shard is None:
+        return items_list
+
+    return [item for item in items_list if in_shard(item.get('id'), shard)]
+
+
+def merge_outputs(input_files, output=None):
+    """
+    Merge the .csv status outputs of several shards into one report.
+    :param input_files: List of .csv filenames written by shard runs (via --output)
+    :param output: Optional filename to save merged .csv status to, otherwise will be printed to STDOUT.
+    :return: No return
+    """
+    merged_results = []
+
+    for input_file in input_files:
+        with open(input_file, "r") as csv_input:
+            rows = list(csv.reader(csv_input))
+
+        if not rows:
+            throw_warning("'{0}' is empty, skipping.".format(input_file))
+            continue
+
+        if not merged_results:
+            # first file with content, keep header.
+            merged_results.append(rows[0])
+        elif rows[0] != merged_results[0]:
+            throw_error("'{0}' columns do not match previous files. Can only merge outputs of the same run type."
+                        "".format(input_file))
+
+        merged_results.extend(rows[1:])
+
+    # was output to file specified?
+    if output is None:
+        # print
+        print(tabulate(merged_results, headers="firstrow", tablefmt="simple"))
+    else:
+        with open(output, "w") as csv_output:
+            writer = csv.writer(csv_output, quoting=csv.QUOTE_ALL)
+            writer.writerows(merged_results)
+
+
 def diff_tags(list_a, list_b):
     """
     Return human readable diff string of tags changed between two tag lists
@@ -274,11 +459,164 @@ def diff_tags(list_a, list_b):
     return status_str
 
 
+class ExactMatcher(object):
+    """
+    Matcher for exact text values, backed by a set. Drop-in for a compiled regex in check_match().
+    """
+
+    def __init__(self, values):
+        self.values = set([text_type(value) for value in values])
+
+    def match(self, string):
+        return string in self.values
+
+
+class PrefixMatcher(object):
+    """
+    Matcher for text prefixes. Set lookups per distinct prefix length, drop-in for a compiled regex in check_match().
+    """
+
+    def __init__(self, prefixes):
+        self.prefixes_by_length = {}
+        for prefix in prefixes:
+            prefix = text_type(prefix)
+            self.prefixes_by_length.setdefault(len(prefix), set()).add(prefix)
+        self.lengths = sorted(self.prefixes_by_length.keys())
+
+    def match(self, string):
+        for length in self.lengths:
+            if length > len(string):
+                break
+            if string[:length] in self.prefixes_by_length[length]:
+                return True
+        return False
+
+
+def unescape_literal(pattern):
+    """
+    Check if a regex is a plain literal, and if so return the literal text.
+    :param pattern: REGEX pattern text
+    :return: Literal text, or None if the pattern uses any regex features.
+    """
+    literal = text_type("")
+    escaped = False
+    for char in pattern:
+        if escaped:
+            if char.isalnum():
+                # '\d', '\s', etc. are regex classes, not literals.
+                return None
+            literal += char
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char in REGEX_SPECIAL_CHARS:
+            return None
+        else:
+            literal += char
+
+    if escaped:
+        return None
+    return literal
+
+
+def compile_literal_pattern(pattern):
+    """
+    Try to turn a regex into a fast path matcher. Only handles patterns that are literals, or an alternation of
+    literals, optionally anchored with '^'/'$' and/or followed by '.*'. Keeps re.match() semantics, so an unanchored
+    literal is a prefix match.
+    :param pattern: REGEX pattern text
+    :return: ExactMatcher/PrefixMatcher, or None if pattern needs the regex engine.
+    """
+    body = pattern
+    if body.startswith("^"):
+        # re.match() is always anchored at the start.
+        body = body[1:]
+
+    exact = False
+    if body.endswith("$") and not body.endswith("\\$"):
+        exact = True
+        body = body[:-1]
+    elif body.endswith(".*") and not body.endswith("\\.*"):
+        body = body[:-2]
+
+    # strip one level of grouping around an alternation.
+    grouped = False
+    for group_start in ("(?:", "("):
+        if body.startswith(group_start) and body.endswith(")") and not body.endswith("\\)"):
+            inner = body[len(group_start):-1]
+            if "(" not in inner and ")" not in inner:
+                body = inner
+                grouped = True
+            break
+
+    if exact and "|" in body and not grouped:
+        # 'a|b$' only anchors the last branch, leave it to the regex engine.
+        return None
+
+    literals = []
+    for branch in body.split("|"):
+        literal = unescape_literal(branch)
+        if literal is None:
+            return None
+        literals.append(literal)
+
+    if exact:
+        return ExactMatcher(literals)
+    return PrefixMatcher(literals)
+
+
+def compile_matcher(pattern, match_type='regex'):
+    """
+    Build a matcher for a pattern. For 'regex', plain literal patterns automatically use a fast path matcher.
+    :param pattern: Pattern text
+    :param match_type: One of MATCH_TYPES.
+    :return: Object with a .match(text) method (compiled regex, ExactMatcher or PrefixMatcher).
+    """
+    if match_type == 'exact':
+        return ExactMatcher([pattern])
+    elif match_type == 'prefix':
+        return PrefixMatcher([pattern])
+    elif match_type == 'glob':
+        return re.compile(fnmatch.translate(pattern))
+    elif match_type == 'regex':
+        literal_matcher = compile_literal_pattern(pattern)
+        if literal_matcher is not None:
+            return literal_matcher
+        return re.compile(pattern)
+    else:
+        throw_error("Invalid match type: {0}. Must be one of {1}.".format(match_type, ", ".join(MATCH_TYPES)))
+
+
+def load_match_file(filename, match_type='exact'):
+    """
+    Build a matcher from a file with one value per line.
+    :param filename: Name of text file. Blank lines are ignored.
+    :param match_type: One of MATCH_TYPES. 'regex' is treated as 'exact', as each line is a literal value.
+    :return: Object with a .match(text) method.
+    """
+    with open(filename, "r") as match_input:
+        values = [line.rstrip("\r\n") for line in match_input]
+    values = [value for value in values if value.strip()]
+
+    if not values:
+        throw_error("'{0}' has no values to match.".format(filename))
+
+    if match_type in ['regex', 'exact']:
+        return ExactMatcher(values)
+    elif match_type == 'prefix':
+        return PrefixMatcher(values)
+    elif match_type == 'glob':
+        return re.compile("|".join([fnmatch.translate(value) for value in values]))
+    else:
+        throw_error("Invalid match type: {0}. Must be one of {1}.".format(match_type, ", ".join(MATCH_TYPES)))
+
+
 def check_match(key_name, compiled_pattern, cgx_dict):
     """
     Check match for key/pattern in cgx_dict, return info, but don't modify dict.
     :param key_name: Key name to check
-    :param compiled_pattern: Compiled regex to use to check value of key_name cast to text.
+    :param compiled_pattern: Compiled regex (or any matcher from compile_matcher()) to use to check value of key_name
+                             cast to text.
     :param cgx_dict: CloudGenix config dict.
     :return: Tuple of Match (bool), 'name' in cgx_dict, and key value checked.
     """
@@ -303,8 +641,9 @@ def check_match(key_name, compiled_pattern, cgx_dict):
 def check_do_match(the_tag, action, key_name, compiled_pattern, cgx_dict):
     """
     Check match for key/pattern in cgx_dict, modify dict based on action.
-    :param the_tag: The tag to add or remove.
-    :param action: Action to take with tag if match found
+    :param the_tag: The tag to add or remove. For 'replace', dict of old tag -> new tag.
+    :param action: Action to take with tag if match found. 'sync' adds the tag on match, and removes it on no match.
+                   'replace' only matches objects that currently carry one of the old tags.
     :param key_name: Key in object to read value from
     :param compiled_pattern: Compiled regex to match value of key_name cast to text.
     :param cgx_dict: CloudGenix config dict
@@ -320,6 +659,10 @@ def check_do_match(the_tag, action, key_name, compiled_pattern, cgx_dict):
     # got key val, cast to string. This will allow regex matching on dict or list subkeys.
     match_string = text_type(key_val)
 
+    # replace finds objects by their current tags.
+    if action.lower() == 'replace' and not [tag for tag in extract_tags(cgx_dict) if tag in the_tag]:
+        return False, entry_name, key_val, {}
+
     # check for REGEX match
     if compiled_pattern.match(match_string):
         # got a match.
@@ -328,30 +671,396 @@ def check_do_match(the_tag, action, key_name, compiled_pattern, cgx_dict):
             new_cgx_dict = put_tags([the_tag], cgx_dict)
         elif action.lower() == 'remove':
             new_cgx_dict = remove_tags([the_tag], cgx_dict)
+        elif action.lower() == 'sync':
+            new_cgx_dict = put_tags([the_tag], cgx_dict)
+        elif action.lower() == 'replace':
+            new_cgx_dict = replace_tags(the_tag, cgx_dict)
         else:
             throw_error("Invalid action: {0}.".format(action))
         return True, entry_name, key_val, new_cgx_dict
 
+    elif action.lower() == 'sync':
+        # sync converges membership, so non-matching objects should not have the tag.
+        return False, entry_name, key_val, remove_tags([the_tag], cgx_dict)
+
     else:
         return False, entry_name, key_val, {}
 
 
-def parse_basic_objects(sdk, the_tag, action, simulate, object_name, key_name, compiled_pattern, output=None):
+def get_key_path(cgx_dict, key_path):
+    """
+    Get a value from a CloudGenix config dict using a dotted key path, ex. 'address.country'.
+    :param cgx_dict: CloudGenix config dict.
+    :param key_path: Key name, or dotted path of key names for nested dicts.
+    :return: Value at key path, or None if not present.
+    """
+    value = cgx_dict
+    for key in key_path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def parse_filter(filter_string):
+    """
+    Parse a parent filter specification string.
+    :param filter_string: Filter in 'KEY=REGEX' format. KEY may be a dotted path, ex. 'address.country=^US$'.
+    :return: Tuple of key path and compiled regex.
+    """
+    key_path, separator, pattern = text_type(filter_string).partition("=")
+    if not separator or not key_path:
+        throw_error("Invalid filter '{0}'. Must be in 'KEY=PATTERN' format, ex. 'tags=^hub$'.".format(filter_string))
+
+    return key_path, compile_matcher(pattern)
+
+
+def build_attribute_index(cgx_list, key_paths):
+    """
+    Index CloudGenix config dicts by the values at each key path. List values (ex. tags) are indexed per entry.
+    :param cgx_list: List of CloudGenix config dicts.
+    :param key_paths: List of key names or dotted key paths to index.
+    :return: Dict of key path -> value text -> set of object IDs.
+    """
+    attribute_index = {}
+
+    for key_path in key_paths:
+        value_index = attribute_index.setdefault(key_path, {})
+
+        for cgx_dict in cgx_list:
+            object_id = cgx_dict.get('id')
+            value = get_key_path(cgx_dict, key_path)
+            if value is None:
+                # not set, set it to ""
+                values = [""]
+            elif isinstance(value, list):
+                values = value if value else [""]
+            else:
+                values = [value]
+
+            for entry in values:
+                value_index.setdefault(text_type(entry), set()).add(object_id)
+
+    return attribute_index
+
+
+def filter_ids(attribute_index, filters, all_ids):
+    """
+    Evaluate filters over an attribute index. Each pattern is only checked once per distinct value.
+    :param attribute_index: Index dict, as returned by build_attribute_index()
+    :param filters: List of (key path, compiled regex) tuples. All must match (AND).
+    :param all_ids: Set of all object IDs, returned as-is if no filters.
+    :return: Set of object IDs matching all filters.
+    """
+    matched_ids = set(all_ids)
+
+    for key_path, compiled_pattern in filters:
+        filter_matched_ids = set()
+        for value_text, object_ids in attribute_index.get(key_path, {}).items():
+            if compiled_pattern.match(value_text):
+                filter_matched_ids |= object_ids
+        matched_ids &= filter_matched_ids
+
+    return matched_ids
+
+
+def join_parent_filters(sites_list, elements_list, site_filters=None, element_filters=None):
+    """
+    Resolve site and element filters to the set of element IDs that satisfy both, before any interface is fetched.
+    :param sites_list: List of CloudGenix site config dicts.
+    :param elements_list: List of CloudGenix element config dicts.
+    :param site_filters: Optional list of (key path, compiled regex) tuples for sites.
+    :param element_filters: Optional list of (key path, compiled regex) tuples for elements.
+    :return: Tuple of matching site ID set and matching element ID set (elements at matching sites only).
+    """
+    site_filters = site_filters or []
+    element_filters = element_filters or []
+
+    site_index = build_attribute_index(sites_list, [key_path for key_path, _ in site_filters])
+    site_ids = filter_ids(site_index, site_filters, [site.get('id') for site in sites_list])
+
+    element_index = build_attribute_index(elements_list, [key_path for key_path, _ in element_filters] + ['site_id'])
+    element_ids = filter_ids(element_index, element_filters, [element.get('id') for element in elements_list])
+
+    # join elements to matching sites.
+    element_site_ids = set()
+    for site_id in site_ids:
+        element_site_ids |= element_index['site_id'].get(text_type(site_id), set())
+    element_ids &= element_site_ids
+
+    return site_ids, element_ids
+
+
+class RequestTimer(object):
+    """
+    Run idempotent API GETs with an optional timeout and optional hedging, and keep latency stats per call type.
+    A hedged GET sends a duplicate request once the first has taken longer than the observed latency percentile, and
+    uses whichever response arrives first.
+    """
+
+    def __init__(self, timeout=None, hedge=False, hedge_percentile=DEFAULT_HEDGE_PERCENTILE,
+                 hedge_min_samples=DEFAULT_HEDGE_MIN_SAMPLES):
+        self.timeout = timeout
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        # label -> sorted list of latencies (seconds)
+        self.latencies = {}
+        # label -> dict of counters
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def percentile(self, label, percentile):
+        """
+        Get a latency percentile for a call type.
+        :param label: Call type label
+        :param percentile: Percentile (0-100)
+        :return: Latency in seconds, or None if no samples.
+        """
+        with self.lock:
+            latencies = self.latencies.get(label, [])
+            if not latencies:
+                return None
+            rank = int(math.ceil(percentile / 100.0 * len(latencies))) - 1
+            return latencies[min(max(rank, 0), len(latencies) - 1)]
+
+    def count(self, label, counter):
+        """
+        Increment a counter for a call type.
+        :param label: Call type label
+        :param counter: One of 'calls', 'timeouts', 'hedges', 'hedge_wins'
+        :return: No return
+        """
+        with self.lock:
+            label_counters = self.counters.setdefault(label, {"calls": 0, "timeouts": 0, "hedges": 0,
+                                                              "hedge_wins": 0})
+            label_counters[counter] += 1
+
+    def call(self, label, get_function, *args):
+        """
+        Run a GET function with timeout/hedging.
+        :param label: Call type label for stats, ex. 'interfaces'
+        :param get_function: SDK GET function
+        :param args: Arguments to get_function
+        :return: CloudGenix Extended Requests.Response object, or None on timeout.
+        """
+        results = queue.Queue()
+        start_time = time.time()
+
+        def attempt(attempt_number):
+            try:
+                results.put((attempt_number, get_function(*args), None))
+            except Exception as e:
+                results.put((attempt_number, None, e))
+
+        def start_attempt(attempt_number):
+            # daemon, so an abandoned (timed out) request can't hold the process open.
+            attempt_thread = threading.Thread(target=attempt, args=(attempt_number,))
+            attempt_thread.daemon = True
+            attempt_thread.start()
+
+        self.count(label, "calls")
+        start_attempt(1)
+
+        outcome = None
+        hedge_delay = None
+        with self.lock:
+            sample_count = len(self.latencies.get(label, []))
+        if self.hedge and sample_count >= self.hedge_min_samples:
+            hedge_delay = self.percentile(label, self.hedge_percentile)
+
+        if hedge_delay is not None and (self.timeout is None or hedge_delay < self.timeout):
+            try:
+                outcome = results.get(timeout=hedge_delay)
+            except queue.Empty:
+                # slow, send a duplicate.
+                self.count(label, "hedges")
+                start_attempt(2)
+
+        if outcome is None:
+            if self.timeout is None:
+                outcome = results.get()
+            else:
+                try:
+                    outcome = results.get(timeout=max(self.timeout - (time.time() - start_time), 0))
+                except queue.Empty:
+                    self.count(label, "timeouts")
+                    # record the timeout as the sample, so the tail percentiles are not only over finished calls.
+                    with self.lock:
+                        bisect.insort(self.latencies.setdefault(label, []), self.timeout)
+                    return None
+
+        attempt_number, resp, error = outcome
+        if attempt_number == 2:
+            self.count(label, "hedge_wins")
+
+        with self.lock:
+            bisect.insort(self.latencies.setdefault(label, []), time.time() - start_time)
+
+        if error is not None:
+            raise error
+        return resp
+
+    def report(self):
+        """
+        Write tail latency stats to STDERR.
+        :return: No return
+        """
+        stats = [["Call", "Count", "p50 (s)", "p95 (s)", "p99 (s)", "Max (s)", "Timeouts", "Hedges", "Hedge Wins"]]
+        for label in sorted(self.counters.keys()):
+            label_counters = self.counters[label]
+            percentiles = []
+            for percentile in [50, 95, 99, 100]:
+                latency = self.percentile(label, percentile)
+                percentiles.append(None if latency is None else round(latency, 3))
+            stats.append([label, label_counters["calls"]] + percentiles +
+                         [label_counters["timeouts"], label_counters["hedges"], label_counters["hedge_wins"]])
+
+        if self.timeout is None:
+            sys.stderr.write("API GET latency:\n")
+        else:
+            sys.stderr.write("API GET latency (timed out calls counted as {0}s):\n".format(self.timeout))
+        sys.stderr.write(tabulate(stats, headers="firstrow", tablefmt="simple") + "\n")
+
+
+def timed_get(timer, label, get_function, *args):
+    """
+    Run an API GET through a RequestTimer, if one is in use.
+    :param timer: RequestTimer, or None to call get_function directly.
+    :param label: Call type label for stats, ex. 'interfaces'
+    :param get_function: SDK GET function
+    :param args: Arguments to get_function
+    :return: CloudGenix Extended Requests.Response object, or None on timeout.
+    """
+    if timer is None:
+        return get_function(*args)
+    return timer.call(label, get_function, *args)
+
+
+class ProgressReporter(object):
+    """
+    Throttled progress for a long running loop. Draws a progress bar only when STDERR is a terminal, and optionally
+    writes newline delimited JSON progress events (objects processed, PUTs, errors, throughput and ETA) for
+    orchestration tools.
+    """
+
+    def __init__(self, phase, total, progress_output=None, interval=DEFAULT_PROGRESS_INTERVAL):
+        """
+        Start progress reporting.
+        :param phase: Name of the work being done, ex. 'interfaces'
+        :param total: Total units of work (ex. objects, or site/element pairs that need interface queries)
+        :param progress_output: Optional file object to write JSON progress events to.
+        :param interval: Minimum seconds between progress bar redraws/JSON events.
+        """
+        self.phase = phase
+        self.total = total
+        self.progress_output = progress_output
+        self.interval = interval
+        self.start_time = time.time()
+        self.last_report = self.start_time
+        self.done = 0
+        self.objects = 0
+        self.puts = 0
+        self.errors = 0
+
+        self.pbar = None
+        if sys.stderr.isatty():
+            self.pbar = ProgressBar(widgets=[Percentage(), Bar(), ETA()], max_value=total + 1).start()
+
+        self.write_event("start")
+
+    def update(self, done=0, objects=0, puts=0, errors=0):
+        """
+        Add to progress counters, and report if the throttle interval has passed.
+        :param done: Units of work finished
+        :param objects: Objects processed
+        :param puts: Successful PUTs
+        :param errors: Failed PUTs/queries. Negative for failed PUTs recovered on retry.
+        :return: No return
+        """
+        self.done += done
+        self.objects += objects
+        self.puts += puts
+        self.errors += errors
+
+        now = time.time()
+        if now - self.last_report < self.interval:
+            return
+        self.last_report = now
+
+        if self.pbar is not None:
+            self.pbar.update(min(self.done, self.total) + 1)
+        self.write_event("progress")
+
+    def finish(self):
+        """
+        Finish progress reporting.
+        :return: No return
+        """
+        if self.pbar is not None:
+            self.pbar.finish()
+        self.write_event("finish")
+
+    def write_event(self, event_name):
+        """
+        Write a JSON progress event, if a progress output is set.
+        :param event_name: 'start', 'progress' or 'finish'
+        :return: No return
+        """
+        if self.progress_output is None:
+            return
+
+        elapsed = time.time() - self.start_time
+        rate = self.done / elapsed if elapsed > 0 else None
+        if event_name == 'finish':
+            eta_seconds = 0
+        elif rate:
+            # throughput based, from average time per unit of work so far.
+            eta_seconds = round(max(self.total - self.done, 0) / rate, 1)
+        else:
+            eta_seconds = None
+
+        event = {
+            "event": event_name,
+            "phase": self.phase,
+            "time": round(time.time(), 3),
+            "elapsed_seconds": round(elapsed, 3),
+            "done": self.done,
+            "total": self.total,
+            "objects": self.objects,
+            "puts": self.puts,
+            "errors": self.errors,
+            "objects_per_second": round(self.objects / elapsed, 2) if elapsed > 0 else None,
+            "eta_seconds": eta_seconds
+        }
+        self.progress_output.write(json.dumps(event, sort_keys=True) + "\n")
+        self.progress_output.flush()
+
+
+def parse_basic_objects(sdk, the_tag, action, simulate, object_name, key_name, compiled_pattern, output=None,
+                        shard=None, retries=DEFAULT_RETRIES, failures_output=None, progress_output=None):
     """
     Parse basic API objects based on parameters and add/remove tags based on match(es).
     :param sdk: Authenticated CloudGenix SDK constructor.
-    :param the_tag: Tag to add/remove
-    :param action: Action to be done on tag (add/remove)
+    :param the_tag: Tag to add/remove, or dict of old tag -> new tag for replace
+    :param action: Action to be done on tag (add/remove/sync/replace)
     :param simulate: Bool, is this a simulation only (don't make any changes)
     :param object_name: Object to look up (one of SUPPORTED_OBJECTS)
     :param key_name: Name of key to use in object for matching
     :param compiled_pattern: Compiled regex to match value of key_name cast to text
     :param output: Optional filename to save .csv status to, otherwise will be printed to STDOUT.
+    :param shard: Optional tuple of shard index (1-based) and shard count. Only objects in this shard are processed.
+    :param retries: Number of retry rounds for failed tag changes.
+    :param failures_output: Optional filename to save tag changes that still fail after retries to (--ids format).
+    :param progress_output: Optional file object to write JSON progress events to.
     :return: No return
     """
-    if object_name.lower() not in SUPPORTED_OBJECTS:
+    object_name = object_name.lower()
+    if object_name not in SUPPORTED_OBJECTS:
         throw_error("Object {0} not a supported object in this version.")
 
+    tag_text = describe_tag(the_tag)
+
     if simulate:
         output_results = [["Tag", "Action", "Object Name", "Object Key", "Object Key Value", "Object Match",
                            "Change Detail (Simulated)"]]
@@ -359,63 +1068,65 @@ def parse_basic_objects(sdk, the_tag, action, simulate, object_name, key_name, c
         output_results = [["Tag", "Action", "Object Name", "Object Key", "Object Key Value", "Object Match",
                            "Change Detail"]]
 
-    if object_name == 'sites':
-        sites_list = extract_items(sdk.get.sites(), 'sites')
+    # tag changes that failed to write, retried at the end.
+    failed_writes = []
 
-        firstbar = len(sites_list) + 1
-        barcount = 1
+    if object_name == 'sites':
+        sites_list = shard_items(extract_items(sdk.get.sites(), 'sites'), shard)
 
         print("Working on '{0}'..".format(object_name))
 
-        # could be a long query - start a progress bar.
-        pbar = ProgressBar(widgets=[Percentage(), Bar(), ETA()], max_value=firstbar).start()
+        # could be a long query - start progress reporting.
+        progress = ProgressReporter(object_name, len(sites_list), progress_output)
 
         for site in list(sites_list):
             site_id = site.get('id')
             match_status, entry_name, key_val, modified_site = check_do_match(the_tag, action,
                                                                               key_name, compiled_pattern, site)
 
-            if match_status:
+            if match_status or action.lower() == 'sync':
                 if simulate:
-                    output_results.append([the_tag, action, entry_name, key_name, key_val,
+                    output_results.append([tag_text, action, entry_name, key_name, key_val,
                                            match_status, diff_tags(extract_tags(site), extract_tags(modified_site))])
 
                 else:
                     # Check if changes needed
                     if diff_tags(extract_tags(site), extract_tags(modified_site)) == 'no changes required.':
                         # No Changes Needed!
-                        output_results.append([the_tag, action, entry_name, key_name, key_val,
+                        output_results.append([tag_text, action, entry_name, key_name, key_val,
                                                match_status, diff_tags(extract_tags(site),
                                                                        extract_tags(modified_site))])
                     else:
                         # Need to make changes.
                         site_change_resp = sdk.put.sites(site_id, modified_site)
                         if site_change_resp.cgx_status:
-                            output_results.append([the_tag, action, entry_name, key_name, key_val,
+                            progress.update(puts=1)
+                            output_results.append([tag_text, action, entry_name, key_name, key_val,
                                                    match_status,
                                                    diff_tags(extract_tags(site),
                                                              extract_tags(site_change_resp.cgx_content))])
                         else:
                             throw_warning("'{0}' tag change failed:".format(entry_name), site_change_resp)
+                            progress.update(errors=1)
+                            failed_writes.append({
+                                "object_name": object_name,
+                                "ids": {"id": site_id},
+                                "name": entry_name,
+                                "status": site_change_resp.status_code,
+                                "row": [tag_text, action, entry_name, key_name, key_val, match_status]
+                            })
             else:
-                output_results.append([the_tag, action, entry_name, key_name, key_val,
+                output_results.append([tag_text, action, entry_name, key_name, key_val,
                                        match_status, None])
-            barcount += 1
-            pbar.update(barcount)
-
-        # finish after iteration.
-        pbar.finish()
+            progress.update(done=1, objects=1)
 
     elif object_name == 'elements':
-        elements_list = extract_items(sdk.get.elements(), 'elements')
-
-        firstbar = len(elements_list) + 1
-        barcount = 1
+        elements_list = shard_items(extract_items(sdk.get.elements(), 'elements'), shard)
 
         print("Working on '{0}'..".format(object_name))
 
-        # could be a long query - start a progress bar.
-        pbar = ProgressBar(widgets=[Percentage(), Bar(), ETA()], max_value=firstbar).start()
+        # could be a long query - start progress reporting.
+        progress = ProgressReporter(object_name, len(elements_list), progress_output)
 
         for element in list(elements_list):
             element_id = element.get('id')
@@ -425,9 +1136,9 @@ def parse_basic_objects(sdk, the_tag, action, simulate, object_name, key_name, c
             # print("PREV TAGS: {0}".format(extract_tags(element)))
             # print("MOD  TAGS: {0}".format(extract_tags(modified_element)))
 
-            if match_status:
+            if match_status or action.lower() == 'sync':
                 if simulate:
-                    output_results.append([the_tag, action, entry_name, key_name, key_val,
+                    output_results.append([tag_text, action, entry_name, key_name, key_val,
                                            match_status, diff_tags(extract_tags(element),
                                                                    extract_tags(modified_element))])
 
@@ -436,46 +1147,40 @@ def parse_basic_objects(sdk, the_tag, action, simulate, object_name, key_name, c
                     if diff_tags(extract_tags(element),
                                  extract_tags(modified_element)) == 'no changes required.':
                         # No Changes Needed!
-                        output_results.append([the_tag, action, entry_name, key_name, key_val,
+                        output_results.append([tag_text, action, entry_name, key_name, key_val,
                                                match_status, diff_tags(extract_tags(element),
                                                                        extract_tags(modified_element))])
                     else:
                         # Need to make changes.
-                        # clean up element template.
-                        for key in dict(modified_element).keys():
-                            if key not in ELEMENT_PUT_ITEMS:
-                                del modified_element[key]
-
-                        # Add missing elem attributes
-                        modified_element['sw_obj'] = None
-
-                        element_change_resp = sdk.put.elements(element_id, modified_element)
+                        element_change_resp = sdk.put.elements(element_id, clean_element_put(modified_element))
                         if element_change_resp.cgx_status:
-                            output_results.append([the_tag, action, entry_name, key_name, key_val,
+                            progress.update(puts=1)
+                            output_results.append([tag_text, action, entry_name, key_name, key_val,
                                                    match_status,
                                                    diff_tags(extract_tags(element),
                                                              extract_tags(element_change_resp.cgx_content))])
                         else:
                             throw_warning("'{0}' tag change failed:".format(entry_name), element_change_resp)
+                            progress.update(errors=1)
+                            failed_writes.append({
+                                "object_name": object_name,
+                                "ids": {"id": element_id},
+                                "name": entry_name,
+                                "status": element_change_resp.status_code,
+                                "row": [tag_text, action, entry_name, key_name, key_val, match_status]
+                            })
             else:
-                output_results.append([the_tag, action, entry_name, key_name, key_val,
+                output_results.append([tag_text, action, entry_name, key_name, key_val,
                                        match_status, None])
-            barcount += 1
-            pbar.update(barcount)
-
-        # finish after iteration.
-        pbar.finish()
+            progress.update(done=1, objects=1)
 
     elif object_name == 'circuitcatagories':
-        circuitcatagories_list = extract_items(sdk.get.waninterfacelabels(), 'circuitcatagories')
-
-        firstbar = len(circuitcatagories_list) + 1
-        barcount = 1
+        circuitcatagories_list = shard_items(extract_items(sdk.get.waninterfacelabels(), 'circuitcatagories'), shard)
 
         print("Working on '{0}'..".format(object_name))
 
-        # could be a long query - start a progress bar.
-        pbar = ProgressBar(widgets=[Percentage(), Bar(), ETA()], max_value=firstbar).start()
+        # could be a long query - start progress reporting.
+        progress = ProgressReporter(object_name, len(circuitcatagories_list), progress_output)
 
         for circuitcatagory in list(circuitcatagories_list):
             circuitcatagory_id = circuitcatagory.get('id')
@@ -483,9 +1188,9 @@ def parse_basic_objects(sdk, the_tag, action, simulate, object_name, key_name, c
                                                                                          key_name, compiled_pattern,
                                                                                          circuitcatagory)
 
-            if match_status:
+            if match_status or action.lower() == 'sync':
                 if simulate:
-                    output_results.append([the_tag, action, entry_name, key_name, key_val,
+                    output_results.append([tag_text, action, entry_name, key_name, key_val,
                                            match_status, diff_tags(extract_tags(circuitcatagory),
                                                                    extract_tags(modified_circuitcatagory))])
 
@@ -494,7 +1199,7 @@ def parse_basic_objects(sdk, the_tag, action, simulate, object_name, key_name, c
                     if diff_tags(extract_tags(circuitcatagory),
                                  extract_tags(modified_circuitcatagory)) == 'no changes required.':
                         # No Changes Needed!
-                        output_results.append([the_tag, action, entry_name, key_name, key_val,
+                        output_results.append([tag_text, action, entry_name, key_name, key_val,
                                                match_status, diff_tags(extract_tags(circuitcatagory),
                                                                        extract_tags(modified_circuitcatagory))])
                     else:
@@ -502,22 +1207,37 @@ def parse_basic_objects(sdk, the_tag, action, simulate, object_name, key_name, c
                         circuitcatagory_change_resp = sdk.put.waninterfacelabels(circuitcatagory_id,
                                                                                  modified_circuitcatagory)
                         if circuitcatagory_change_resp.cgx_status:
-                            output_results.append([the_tag, action, entry_name, key_name, key_val,
+                            progress.update(puts=1)
+                            output_results.append([tag_text, action, entry_name, key_name, key_val,
                                                    match_status,
                                                    diff_tags(extract_tags(circuitcatagory),
                                                              extract_tags(circuitcatagory_change_resp.cgx_content))])
                         else:
                             throw_warning("'{0}' tag change failed:".format(entry_name), circuitcatagory_change_resp)
+                            progress.update(errors=1)
+                            failed_writes.append({
+                                "object_name": object_name,
+                                "ids": {"id": circuitcatagory_id},
+                                "name": entry_name,
+                                "status": circuitcatagory_change_resp.status_code,
+                                "row": [tag_text, action, entry_name, key_name, key_val, match_status]
+                            })
             else:
-                output_results.append([the_tag, action, entry_name, key_name, key_val,
+                output_results.append([tag_text, action, entry_name, key_name, key_val,
                                        match_status, None])
-            barcount += 1
-            pbar.update(barcount)
+            progress.update(done=1, objects=1)
 
-        # finish after iteration.
-        pbar.finish()
+    else:
+        # interfaces need site/element context, see parse_interfaces().
+        throw_error("Object {0} needs parse_interfaces().".format(object_name))
 
-        # was output to file specified?
+    output_results.extend(retry_failed_writes(sdk, the_tag, action, key_name, compiled_pattern, failed_writes,
+                                              retries, failures_output, progress=progress))
+
+    # finish after retries, so the final counts include them.
+    progress.finish()
+
+    # was output to file specified?
     if output is None:
         # print
         print(tabulate(output_results, headers="firstrow", tablefmt="simple"))
@@ -529,13 +1249,15 @@ def parse_basic_objects(sdk, the_tag, action, simulate, object_name, key_name, c
 
 def parse_interfaces(sdk, the_tag, action, simulate, object_name, key_name, compiled_pattern,
                      site_key_name, site_compiled_pattern,
-                     element_key_name, element_compiled_pattern, output=None):
+                     element_key_name, element_compiled_pattern, output=None, shard=None,
+                     site_filters=None, element_filters=None, timer=None, retries=DEFAULT_RETRIES,
+                     failures_output=None, progress_output=None):
     """
     Parse Interfaces API objects based on parameters and add/remove tags based on match(es). Need to match site/element
     at same time - so much more involved.
     :param sdk: Authenticated CloudGenix SDK constructor.
-    :param the_tag: Tag to add/remove
-    :param action: Action to be done on tag (add/remove)
+    :param the_tag: Tag to add/remove, or dict of old tag -> new tag for replace
+    :param action: Action to be done on tag (add/remove/sync/replace)
     :param simulate: Bool, is this a simulation only (don't make any changes)
     :param object_name: Object to look up (one of SUPPORTED_OBJECTS)
     :param key_name: Name of key to use in object for matching
@@ -545,11 +1267,22 @@ def parse_interfaces(sdk, the_tag, action, simulate, object_name, key_name, comp
     :param element_key_name: Name of key to use in ELEMENT object for matching
     :param element_compiled_pattern: Compiled regex to match value of element_key_name cast to text
     :param output: Optional filename to save .csv status to, otherwise will be printed to STDOUT.
+    :param shard: Optional tuple of shard index (1-based) and shard count. Only site/element pairs whose element is
+                  in this shard are processed.
+    :param site_filters: Optional list of (key path, compiled regex) tuples. Sites must also match all of these.
+    :param element_filters: Optional list of (key path, compiled regex) tuples. Elements must also match all of these.
+    :param timer: Optional RequestTimer to apply timeouts/hedging to interface queries.
+    :param retries: Number of retry rounds for failed tag changes.
+    :param failures_output: Optional filename to save tag changes that still fail after retries to (--ids format).
+    :param progress_output: Optional file object to write JSON progress events to.
     :return: No Return
     """
-    if object_name.lower() not in ['interfaces']:
+    object_name = object_name.lower()
+    if object_name not in ['interfaces']:
         throw_error("Object {0} not a supported object in this version.")
 
+    tag_text = describe_tag(the_tag)
+
     if simulate:
         output_results = [["Tag", "Action", "Site Name", "Site Key", "Site Key Value", "Site Match",
                            "Element Name", "Element Key", "Element Key Value", "Element Match",
@@ -561,6 +1294,9 @@ def parse_interfaces(sdk, the_tag, action, simulate, object_name, key_name, comp
                            "Object Name", "Object Key", "Object Key Value", "Object Match",
                            "Change Detail"]]
 
+    # tag changes that failed to write, retried at the end.
+    failed_writes = []
+
     if object_name == 'interfaces':
 
         sites_list = extract_items(sdk.get.sites(), 'sites')
@@ -573,10 +1309,20 @@ def parse_interfaces(sdk, the_tag, action, simulate, object_name, key_name, comp
         # list of lists containing [site_id, element id]
         all_site_element_list = []
 
+        # resolve compound parent filters up front, so only elements that satisfy everything get interface queries.
+        if site_filters or element_filters:
+            filter_site_ids, filter_element_ids = join_parent_filters(sites_list, elements_list,
+                                                                      site_filters, element_filters)
+        else:
+            filter_site_ids = None
+            filter_element_ids = None
+
         # check site matches, build site match lookup table.
         for site in list(sites_list):
             site_id = site.get('id')
             site_match_status, site_entry_name, site_key_val, = check_match(site_key_name, site_compiled_pattern, site)
+            if filter_site_ids is not None:
+                site_match_status = site_match_status and site_id in filter_site_ids
 
             site_match_lookup[site_id] = {
                 "site_entry_name": site_entry_name,
@@ -589,13 +1335,15 @@ def parse_interfaces(sdk, the_tag, action, simulate, object_name, key_name, comp
             element_id = element.get('id')
             element_site_id = element.get('site_id')
 
-            # add to all site->element iteration list
-            if element_id and element_site_id:
+            # add to all site->element iteration list, if this element is in our shard.
+            if element_id and element_site_id and in_shard(element_id, shard):
                 all_site_element_list.append([element_site_id, element_id])
 
             # check for match.
             element_match_status, element_entry_name, element_key_val, = check_match(element_key_name,
                                                                                      element_compiled_pattern, element)
+            if filter_element_ids is not None:
+                element_match_status = element_match_status and element_id in filter_element_ids
 
             element_match_lookup[element_id] = {
                 "element_entry_name": element_entry_name,
@@ -603,14 +1351,17 @@ def parse_interfaces(sdk, the_tag, action, simulate, object_name, key_name, comp
                 "element_match_status": element_match_status
             }
 
-        # Great, now we have max objects that can be queried. Set status bar
-        firstbar = len(all_site_element_list) + 1
-        barcount = 1
+        # Great, now we know which site/element pairs need interface queries. Only those take real time, so use
+        # them for progress/ETA.
+        query_pair_count = len([site_element for site_element in all_site_element_list
+                                if site_element[0] != "1"
+                                and site_match_lookup.get(site_element[0], {}).get("site_match_status")
+                                and element_match_lookup.get(site_element[1], {}).get("element_match_status")])
 
         print("Working on 'interfaces'..")
 
-        # could be a long query - start a progress bar.
-        pbar = ProgressBar(widgets=[Percentage(), Bar(), ETA()], max_value=firstbar).start()
+        # could be a long query - start progress reporting.
+        progress = ProgressReporter(object_name, query_pair_count, progress_output)
 
         for site_id_element_id_list in all_site_element_list:
             site_id = site_id_element_id_list[0]
@@ -621,20 +1372,14 @@ def parse_interfaces(sdk, the_tag, action, simulate, object_name, key_name, comp
 
             if site_id == "1":
                 # site id 1 = unassigned. Silently skip, as can't modify interfaces for unassigned elements.
-                barcount += 1
-                pbar.update(barcount)
                 continue
             if site_lookup is None:
                 # error, these should not be missing. Throw warning.
                 throw_warning("Unable to read site match data for site_id {0}. Skipping.".format(site_id))
-                barcount += 1
-                pbar.update(barcount)
                 continue
             elif element_lookup is None:
                 # error, these should not be missing. Throw warning.
                 throw_warning("Unable to read element match data for element_id {0}. Skipping.".format(element_id))
-                barcount += 1
-                pbar.update(barcount)
                 continue
 
             # get all of the saved match info.
@@ -647,7 +1392,27 @@ def parse_interfaces(sdk, the_tag, action, simulate, object_name, key_name, comp
 
             if site_match_status and element_match_status:
                 # need to iterate and check interfaces.
-                interfaces_list = extract_items(sdk.get.interfaces(site_id, element_id), 'interfaces')
+                interfaces_resp = timed_get(timer, 'interfaces', sdk.get.interfaces, site_id, element_id)
+                if interfaces_resp is None:
+                    throw_warning("Interface query for element '{0}' timed out. Skipping.".format(element_entry_name))
+                    progress.update(errors=1)
+                    # keep the element in the output, so the report shows its interfaces were not checked.
+                    output_results.append([tag_text, action, site_entry_name, site_key_name, site_key_val,
+                                           site_match_status, element_entry_name, element_key_name,
+                                           element_key_val, element_match_status, None, None, None, None,
+                                           "FAILED: query timed out"])
+                    interfaces_list = []
+                elif not interfaces_resp.cgx_status:
+                    throw_warning("Unable to get interfaces for element '{0}'. Skipping:".format(element_entry_name),
+                                  interfaces_resp)
+                    progress.update(errors=1)
+                    output_results.append([tag_text, action, site_entry_name, site_key_name, site_key_val,
+                                           site_match_status, element_entry_name, element_key_name,
+                                           element_key_val, element_match_status, None, None, None, None,
+                                           "FAILED: {0}".format(interfaces_resp.status_code)])
+                    interfaces_list = []
+                else:
+                    interfaces_list = extract_items(interfaces_resp, 'interfaces')
 
                 for interface in list(interfaces_list):
                     interface_id = interface.get('id')
@@ -661,9 +1426,11 @@ def parse_interfaces(sdk, the_tag, action, simulate, object_name, key_name, comp
                         # have to silently skip, can't modify controller 2.
                         continue
 
-                    if match_status:
+                    progress.update(objects=1)
+
+                    if match_status or action.lower() == 'sync':
                         if simulate:
-                            output_results.append([the_tag, action, site_entry_name, site_key_name, site_key_val,
+                            output_results.append([tag_text, action, site_entry_name, site_key_name, site_key_val,
                                                    site_match_status, element_entry_name, element_key_name,
                                                    element_key_val, element_match_status, entry_name, key_name, key_val,
                                                    match_status, diff_tags(extract_tags(interface),
@@ -674,7 +1441,7 @@ def parse_interfaces(sdk, the_tag, action, simulate, object_name, key_name, comp
                             if diff_tags(extract_tags(interface),
                                          extract_tags(modified_interface)) == 'no changes required.':
                                 # Don't need to submit, tags are already correct.
-                                output_results.append([the_tag, action, site_entry_name, site_key_name, site_key_val,
+                                output_results.append([tag_text, action, site_entry_name, site_key_name, site_key_val,
                                                        site_match_status, element_entry_name, element_key_name,
                                                        element_key_val, element_match_status, entry_name, key_name,
                                                        key_val,
@@ -686,7 +1453,8 @@ def parse_interfaces(sdk, the_tag, action, simulate, object_name, key_name, comp
                                 interface_change_resp = sdk.put.interfaces(site_id, element_id, interface_id,
                                                                            modified_interface)
                                 if interface_change_resp.cgx_status:
-                                    output_results.append([the_tag, action, site_entry_name, site_key_name,
+                                    progress.update(puts=1)
+                                    output_results.append([tag_text, action, site_entry_name, site_key_name,
                                                            site_key_val, site_match_status, element_entry_name,
                                                            element_key_name, element_key_val, element_match_status,
                                                            entry_name, key_name, key_val, match_status,
@@ -695,35 +1463,875 @@ def parse_interfaces(sdk, the_tag, action, simulate, object_name, key_name, comp
 
                                 else:
                                     throw_warning("'{0}' tag change failed:".format(entry_name), interface_change_resp)
+                                    progress.update(errors=1)
+                                    failed_writes.append({
+                                        "object_name": object_name,
+                                        "ids": {"site_id": site_id, "element_id": element_id, "id": interface_id},
+                                        "name": entry_name,
+                                        "status": interface_change_resp.status_code,
+                                        "row": [tag_text, action, site_entry_name, site_key_name, site_key_val,
+                                                site_match_status, element_entry_name, element_key_name,
+                                                element_key_val, element_match_status, entry_name, key_name,
+                                                key_val, match_status]
+                                    })
                     else:
                         # no match on Interface.
-                        output_results.append([the_tag, action, site_entry_name, site_key_name, site_key_val,
+                        output_results.append([tag_text, action, site_entry_name, site_key_name, site_key_val,
                                                site_match_status, element_entry_name, element_key_name,
                                                element_key_val, element_match_status, entry_name, key_name, key_val,
                                                match_status, None])
 
             else:
                 # no match, just update output.
-                output_results.append([the_tag, action, site_entry_name, site_key_name, site_key_val, site_match_status,
-                                       element_entry_name, element_key_name, element_key_val, element_match_status,
-                                       None, None, None, None, None])
+                output_results.append([tag_text, action, site_entry_name, site_key_name, site_key_val,
+                                       site_match_status, element_entry_name, element_key_name, element_key_val,
+                                       element_match_status, None, None, None, None, None])
 
             # finished this site_id/element_id pair. next.
-            barcount += 1
-            pbar.update(barcount)
+            if site_match_status and element_match_status:
+                progress.update(done=1)
+
+    output_results.extend(retry_failed_writes(sdk, the_tag, action, key_name, compiled_pattern, failed_writes,
+                                              retries, failures_output, timer, progress))
+
+    # finish after retries, so the final counts include them.
+    progress.finish()
+
+    # was output to file specified?
+    if output is None:
+        # print
+        print(tabulate(output_results, headers="firstrow", tablefmt="simple"))
+    else:
+        with open(output, "w") as csv_output:
+            writer = csv.writer(csv_output, quoting=csv.QUOTE_ALL)
+            writer.writerows(output_results)
+
+
+def load_id_rows(filename, object_name):
+    """
+    Load object IDs for targeted mode from a .csv file with a header row.
+    :param filename: Name of .csv file. Needs an 'id' column (or '<object>_id', ex. 'site_id' for sites), and
+                     'site_id'/'element_id' columns for interfaces.
+    :param object_name: Object the IDs are for (one of SUPPORTED_OBJECTS)
+    :return: List of dicts with 'site_id', 'element_id' and 'id' keys. Duplicate rows are removed.
+    """
+    if object_name.lower() not in SUPPORTED_OBJECTS:
+        throw_error("Object {0} not a supported object in this version.".format(object_name))
+
+    id_column_names = ID_COLUMNS[object_name]
+    id_rows = []
+    # (site_id, element_id, id) already loaded. Duplicates would GET/PUT the same object concurrently, and conflict.
+    seen_ids = set()
+    duplicate_count = 0
+
+    with open(filename, "r") as csv_input:
+        reader = csv.DictReader(csv_input)
+        fieldnames = reader.fieldnames or []
+
+        id_column = None
+        for column_name in id_column_names:
+            if column_name in fieldnames:
+                id_column = column_name
+                break
+        if id_column is None:
+            throw_error("'{0}' needs one of these columns for '{1}': {2}.".format(filename, object_name,
+                                                                               ", ".join(id_column_names)))
+        if object_name == 'interfaces' and not ('site_id' in fieldnames and 'element_id' in fieldnames):
+            throw_error("'{0}' needs 'site_id' and 'element_id' columns for 'interfaces'.".format(filename))
+
+        for row in reader:
+            object_id = row.get(id_column)
+            if not object_id:
+                # skip blank lines
+                continue
+            row_key = (row.get('site_id'), row.get('element_id'), object_id)
+            if row_key in seen_ids:
+                duplicate_count += 1
+                continue
+            seen_ids.add(row_key)
+            id_rows.append({
+                "site_id": row.get('site_id'),
+                "element_id": row.get('element_id'),
+                "id": object_id
+            })
+
+    if duplicate_count:
+        throw_warning("Skipped {0} duplicate ID row(s) in '{1}'.".format(duplicate_count, filename))
+
+    return id_rows
+
+
+def clean_element_put(modified_element):
+    """
+    Strip an element config dict down to the keys the elements PUT API accepts.
+    :param modified_element: CloudGenix element config dict. Modified in place.
+    :return: Cleaned element config dict
+    """
+    # clean up element template.
+    for key in dict(modified_element).keys():
+        if key not in ELEMENT_PUT_ITEMS:
+            del modified_element[key]
+
+    # Add missing elem attributes
+    modified_element['sw_obj'] = None
+
+    return modified_element
+
+
+def get_object(sdk, object_name, ids, timer=None):
+    """
+    GET a single object by ID.
+    :param sdk: Authenticated CloudGenix SDK constructor.
+    :param object_name: Object to get (one of SUPPORTED_OBJECTS)
+    :param ids: Dict with 'id', and 'site_id'/'element_id' for interfaces.
+    :param timer: Optional RequestTimer to apply timeouts/hedging.
+    :return: CloudGenix Extended Requests.Response object, or None on timeout.
+    """
+    if object_name == 'sites':
+        return timed_get(timer, object_name, sdk.get.sites, ids["id"])
+    elif object_name == 'elements':
+        return timed_get(timer, object_name, sdk.get.elements, ids["id"])
+    elif object_name == 'interfaces':
+        return timed_get(timer, object_name, sdk.get.interfaces, ids["site_id"], ids["element_id"], ids["id"])
+    elif object_name == 'circuitcatagories':
+        return timed_get(timer, object_name, sdk.get.waninterfacelabels, ids["id"])
+    else:
+        throw_error("Object {0} not a supported object in this version.".format(object_name))
+
+
+def put_object(sdk, object_name, ids, modified_dict):
+    """
+    PUT a single modified object by ID.
+    :param sdk: Authenticated CloudGenix SDK constructor.
+    :param object_name: Object to put (one of SUPPORTED_OBJECTS)
+    :param ids: Dict with 'id', and 'site_id'/'element_id' for interfaces.
+    :param modified_dict: Modified CloudGenix config dict.
+    :return: CloudGenix Extended Requests.Response object.
+    """
+    if object_name == 'sites':
+        return sdk.put.sites(ids["id"], modified_dict)
+    elif object_name == 'elements':
+        return sdk.put.elements(ids["id"], clean_element_put(modified_dict))
+    elif object_name == 'interfaces':
+        return sdk.put.interfaces(ids["site_id"], ids["element_id"], ids["id"], modified_dict)
+    elif object_name == 'circuitcatagories':
+        return sdk.put.waninterfacelabels(ids["id"], modified_dict)
+    else:
+        throw_error("Object {0} not a supported object in this version.".format(object_name))
+
+
+def parse_targeted_objects(sdk, the_tag, action, simulate, object_name, key_name, compiled_pattern, id_rows,
+                           output=None, shard=None, workers=DEFAULT_WORKERS, timer=None, retries=DEFAULT_RETRIES,
+                           failures_output=None, progress_output=None):
+    """
+    Fetch objects by ID and add/remove tags based on match(es), without listing the tenant. Objects are fetched and
+    updated concurrently.
+    :param sdk: Authenticated CloudGenix SDK constructor.
+    :param the_tag: Tag to add/remove, or dict of old tag -> new tag for replace
+    :param action: Action to be done on tag (add/remove/sync/replace)
+    :param simulate: Bool, is this a simulation only (don't make any changes)
+    :param object_name: Object to look up (one of SUPPORTED_OBJECTS)
+    :param key_name: Name of key to use in object for matching
+    :param compiled_pattern: Compiled regex to match value of key_name cast to text
+    :param id_rows: List of dicts with 'id', and 'site_id'/'element_id' for interfaces, as returned by load_id_rows()
+    :param output: Optional filename to save .csv status to, otherwise will be printed to STDOUT.
+    :param shard: Optional tuple of shard index (1-based) and shard count. Only objects in this shard are processed.
+    :param workers: Number of concurrent API workers.
+    :param timer: Optional RequestTimer to apply timeouts/hedging to object queries.
+    :param retries: Number of retry rounds for failed tag changes.
+    :param failures_output: Optional filename to save tag changes that still fail after retries to (--ids format).
+    :param progress_output: Optional file object to write JSON progress events to.
+    :return: No return
+    """
+    if object_name.lower() not in SUPPORTED_OBJECTS:
+        throw_error("Object {0} not a supported object in this version.".format(object_name))
+
+    tag_text = describe_tag(the_tag)
+
+    if simulate:
+        output_results = [["Tag", "Action", "Site ID", "Element ID", "Object ID", "Object Name", "Object Key",
+                           "Object Key Value", "Object Match", "Change Detail (Simulated)"]]
+    else:
+        output_results = [["Tag", "Action", "Site ID", "Element ID", "Object ID", "Object Name", "Object Key",
+                           "Object Key Value", "Object Match", "Change Detail"]]
+
+    id_rows = [ids for ids in id_rows if in_shard(ids["id"], shard)]
+
+    if object_name == 'interfaces':
+        # site id 1 = unassigned. Silently skip, as can't modify interfaces for unassigned elements.
+        id_rows = [ids for ids in id_rows if ids["site_id"] != "1"]
+
+    # tag changes that failed to write, retried at the end. list.append is thread safe.
+    failed_writes = []
+    # returned by do_object() for objects that are silently skipped, or whose query/tag change failed (retried
+    # later).
+    skipped = object()
+    failed = object()
+
+    def make_row(ids, entry_name, key_val, match_status):
+        # output row, without change detail.
+        return [tag_text, action, ids["site_id"], ids["element_id"], ids["id"], entry_name, key_name, key_val,
+                match_status]
+
+    def do_object(ids):
+        # returns output row, skipped, or failed.
+        object_resp = get_object(sdk, object_name, ids, timer)
+        if object_resp is None or not object_resp.cgx_status:
+            if object_resp is None:
+                throw_warning("Query for {0} id {1} timed out.".format(object_name, ids["id"]))
+            else:
+                throw_warning("Unable to get {0} id {1}:".format(object_name, ids["id"]), object_resp)
+            failed_writes.append({
+                "object_name": object_name,
+                "ids": ids,
+                "name": None,
+                "status": 'query timed out' if object_resp is None else object_resp.status_code,
+                "row": make_row(ids, None, None, None),
+                "make_row": lambda entry_name, key_val, match_status: make_row(ids, entry_name, key_val,
+                                                                               match_status)
+            })
+            return failed
+        cgx_dict = object_resp.cgx_content
+
+        match_status, entry_name, key_val, modified_dict = check_do_match(the_tag, action, key_name,
+                                                                          compiled_pattern, cgx_dict)
+
+        if object_name == 'interfaces' and entry_name == 'controller 2':
+            # have to silently skip, can't modify controller 2.
+            return skipped
+
+        row = make_row(ids, entry_name, key_val, match_status)
+
+        if not (match_status or action.lower() == 'sync'):
+            return row + [None]
+
+        change_detail = diff_tags(extract_tags(cgx_dict), extract_tags(modified_dict))
+        if simulate or change_detail == 'no changes required.':
+            return row + [change_detail]
+
+        # need to make changes.
+        change_resp = put_object(sdk, object_name, ids, modified_dict)
+        if not change_resp.cgx_status:
+            throw_warning("'{0}' tag change failed:".format(entry_name), change_resp)
+            failed_writes.append({
+                "object_name": object_name,
+                "ids": ids,
+                "name": entry_name,
+                "status": change_resp.status_code,
+                "row": row
+            })
+            return failed
+        return row + [diff_tags(extract_tags(cgx_dict), extract_tags(change_resp.cgx_content))]
+
+    print("Working on {0} '{1}' by ID..".format(len(id_rows), object_name))
+
+    # could be a long query - start progress reporting.
+    progress = ProgressReporter(object_name, len(id_rows), progress_output)
+
+    pool = ThreadPool(max(1, workers))
+    try:
+        for row in pool.imap(do_object, id_rows):
+            if row is skipped:
+                progress.update(done=1)
+                continue
+            if row is failed:
+                progress.update(done=1, objects=1, errors=1)
+                continue
+            output_results.append(row)
+            # a live (not simulated) change detail means a PUT was made.
+            changed = not simulate and row[-1] not in [None, 'no changes required.']
+            progress.update(done=1, objects=1, puts=1 if changed else 0)
+    finally:
+        pool.close()
+        pool.join()
+
+    output_results.extend(retry_failed_writes(sdk, the_tag, action, key_name, compiled_pattern, failed_writes,
+                                              retries, failures_output, timer, progress, simulate))
+
+    # finish after retries, so the final counts include them.
+    progress.finish()
+
+    # was output to file specified?
+    if output is None:
+        # print
+        print(tabulate(output_results, headers="firstrow", tablefmt="simple"))
+    else:
+        with open(output, "w") as csv_output:
+            writer = csv.writer(csv_output, quoting=csv.QUOTE_ALL)
+            writer.writerows(output_results)
+
+
+def retry_failed_writes(sdk, the_tag, action, key_name, compiled_pattern, failed_writes, retries=DEFAULT_RETRIES,
+                        failures_output=None, timer=None, progress=None, simulate=False):
+    """
+    Retry tag changes that failed to write. Each retry re-reads the object, so changes are made against the current
+    config (and _etag). Anything still failing is reported as FAILED, and saved to a file usable with --ids to retry
+    only those objects.
+    :param sdk: Authenticated CloudGenix SDK constructor.
+    :param the_tag: Tag to add/remove, or dict of old tag -> new tag for replace
+    :param action: Action to be done on tag (add/remove/sync/replace)
+    :param key_name: Name of key to use in object for matching
+    :param compiled_pattern: Compiled regex to match value of key_name cast to text
+    :param failed_writes: List of dicts with 'object_name', 'ids' (as get_object()/put_object()), 'name', 'status'
+                          (HTTP status of the failed write) and 'row' (output row without change detail) for each
+                          failed write. Objects whose query failed also have 'make_row', a function of
+                          (entry_name, key_val, match_status) that builds the row once the object is read.
+    :param retries: Number of retry rounds for the whole queue.
+    :param failures_output: Optional filename to save still failing objects to, in --ids .csv format. Always written
+                            if set, even with no failures. If not set, failures are saved to DEFAULT_FAILURES.
+    :param timer: Optional RequestTimer to apply timeouts/hedging to object queries.
+    :param progress: Optional ProgressReporter the failed writes were counted in. Recovered writes are moved from
+                     its errors to its PUTs.
+    :param simulate: Bool, is this a simulation only. Failed queries are retried, but no changes are made.
+    :return: List of output rows for all failed writes, with change detail, or 'FAILED: <status>' if still failing.
+    """
+    retried_results = []
+
+    for retry_round in range(retries):
+        if not failed_writes:
+            break
+
+        # back off a bit before each round.
+        time.sleep(min(2 ** retry_round, 30))
+        print("Retrying {0} failed change(s), attempt {1} of {2}..".format(len(failed_writes), retry_round + 1,
+                                                                           retries))
+        still_failed = []
+
+        for failed_write in failed_writes:
+            object_name = failed_write["object_name"]
+            ids = failed_write["ids"]
+
+            object_resp = get_object(sdk, object_name, ids, timer)
+            if object_resp is None:
+                failed_write["status"] = 'query timed out'
+                still_failed.append(failed_write)
+                continue
+            if not object_resp.cgx_status:
+                failed_write["status"] = object_resp.status_code
+                still_failed.append(failed_write)
+                continue
+            cgx_dict = object_resp.cgx_content
+
+            match_status, entry_name, key_val, modified_dict = check_do_match(the_tag, action, key_name,
+                                                                              compiled_pattern, cgx_dict)
+            row = failed_write["row"]
+            if "make_row" in failed_write:
+                # query failed before, first time this object is read.
+                row = failed_write["make_row"](entry_name, key_val, match_status)
+                if not (match_status or action.lower() == 'sync'):
+                    retried_results.append(row + [None])
+                    if progress is not None:
+                        progress.update(errors=-1)
+                    continue
+
+            change_detail = diff_tags(extract_tags(cgx_dict), extract_tags(modified_dict))
+            if simulate or not (match_status or action.lower() == 'sync') or \
+                    change_detail == 'no changes required.':
+                # simulated, or changed by someone else in the meantime, nothing left to do.
+                retried_results.append(row + [change_detail if simulate else 'no changes required.'])
+                if progress is not None:
+                    progress.update(errors=-1)
+                continue
+
+            change_resp = put_object(sdk, object_name, ids, modified_dict)
+            if change_resp.cgx_status:
+                if progress is not None:
+                    progress.update(puts=1, errors=-1)
+                retried_results.append(row + [diff_tags(extract_tags(cgx_dict),
+                                                                        extract_tags(change_resp.cgx_content))])
+            else:
+                failed_write["status"] = change_resp.status_code
+                still_failed.append(failed_write)
+
+        failed_writes = still_failed
+
+    # anything left still goes in the output, so the report covers every object.
+    for failed_write in failed_writes:
+        retried_results.append(failed_write["row"] + ["FAILED: {0}".format(failed_write["status"])])
+
+    if failures_output is None and failed_writes:
+        # don't lose the record of what failed.
+        failures_output = DEFAULT_FAILURES.format(time.strftime("%Y%m%d-%H%M%S"))
+
+    if failures_output is not None:
+        # always (re)write, so a file from an earlier run never lists stale failures.
+        with open(failures_output, "w") as csv_output:
+            writer = csv.writer(csv_output, quoting=csv.QUOTE_ALL)
+            writer.writerow(["site_id", "element_id", "id", "name", "status"])
+            for failed_write in failed_writes:
+                ids = failed_write["ids"]
+                writer.writerow([ids.get("site_id"), ids.get("element_id"), ids["id"], failed_write["name"],
+                                 failed_write["status"]])
+
+    if failed_writes:
+        throw_warning("{0} tag change(s) failed after retries. Saved to '{1}', retry them with '--ids {1}'."
+                      "".format(len(failed_writes), failures_output))
+
+    return retried_results
+
+
+def fetch_inventory(sdk, object_name, site_key_name=None, site_compiled_pattern=None,
+                    element_key_name=None, element_compiled_pattern=None, shard=None,
+                    site_filters=None, element_filters=None, timer=None):
+    """
+    Fetch the CloudGenix objects needed to work on object_name into an inventory dict.
+    :param sdk: Authenticated CloudGenix SDK constructor.
+    :param object_name: Object to look up (one of SUPPORTED_OBJECTS)
+    :param site_key_name: Optional name of key to use in SITE object for matching ('interfaces' only)
+    :param site_compiled_pattern: Optional compiled regex to match value of site_key_name cast to text. If set,
+                                  interfaces are only fetched for elements at matching sites.
+    :param element_key_name: Optional name of key to use in ELEMENT object for matching ('interfaces' only)
+    :param element_compiled_pattern: Optional compiled regex to match value of element_key_name cast to text. If set,
+                                     interfaces are only fetched for matching elements.
+    :param shard: Optional tuple of shard index (1-based) and shard count. Only objects in this shard are fetched.
+    :param site_filters: Optional list of (key path, compiled regex) tuples. If set, interfaces are only fetched for
+                         elements at sites matching all of these.
+    :param element_filters: Optional list of (key path, compiled regex) tuples. If set, interfaces are only fetched
+                            for elements matching all of these.
+    :param timer: Optional RequestTimer to apply timeouts/hedging to interface queries.
+    :return: Inventory dict with 'sites', 'elements' and 'circuitcatagories' lists, and 'interfaces' dict of
+             element_id -> interface list.
+    """
+    if object_name.lower() not in SUPPORTED_OBJECTS:
+        throw_error("Object {0} not a supported object in this version.".format(object_name))
+
+    inventory = {
+        "sites": [],
+        "elements": [],
+        "interfaces": {},
+        "circuitcatagories": []
+    }
+
+    if object_name == 'circuitcatagories':
+        inventory["circuitcatagories"] = shard_items(extract_items(sdk.get.waninterfacelabels(),
+                                                                   'circuitcatagories'), shard)
+        return inventory
+
+    # everything else needs sites for names/parents.
+    inventory["sites"] = extract_items(sdk.get.sites(), 'sites')
+    if object_name == 'sites':
+        inventory["sites"] = shard_items(inventory["sites"], shard)
+        return inventory
+
+    inventory["elements"] = extract_items(sdk.get.elements(), 'elements')
+    if object_name == 'elements':
+        inventory["elements"] = shard_items(inventory["elements"], shard)
+        return inventory
+
+    # interfaces, only get for assigned elements that match.
+    site_lookup = dict([(site.get('id'), site) for site in inventory["sites"]])
+    if site_filters or element_filters:
+        _, filter_element_ids = join_parent_filters(inventory["sites"], inventory["elements"],
+                                                    site_filters, element_filters)
+    else:
+        filter_element_ids = None
+
+    for element in inventory["elements"]:
+        element_id = element.get('id')
+        site_id = element.get('site_id')
+
+        if not element_id or not site_id or site_id == "1":
+            continue
+        if not in_shard(element_id, shard):
+            continue
+        if filter_element_ids is not None and element_id not in filter_element_ids:
+            continue
+        if site_compiled_pattern is not None and \
+                not check_match(site_key_name, site_compiled_pattern, site_lookup.get(site_id, {}))[0]:
+            continue
+        if element_compiled_pattern is not None and \
+                not check_match(element_key_name, element_compiled_pattern, element)[0]:
+            continue
+
+        interfaces_resp = timed_get(timer, 'interfaces', sdk.get.interfaces, site_id, element_id)
+        if interfaces_resp is None:
+            throw_warning("Interface query for element '{0}' timed out. Skipping.".format(element.get('name')))
+            continue
+        if not interfaces_resp.cgx_status:
+            throw_warning("Unable to get interfaces for element '{0}'. Skipping:".format(element.get('name')),
+                          interfaces_resp)
+            continue
+        inventory["interfaces"][element_id] = extract_items(interfaces_resp, 'interfaces')
+
+    return inventory
+
+
+def build_tag_index(inventory):
+    """
+    Build an inverted tag index from an inventory.
+    :param inventory: Inventory dict, as returned by fetch_inventory()
+    :return: Index dict with 'tags' (tag -> object_name -> set of IDs), 'objects' (object_name -> ID -> config
+             dict) and 'parents' (ID -> dict of 'site_id' and 'element_id').
+    """
+    index = {
+        "tags": {},
+        "objects": {},
+        "parents": {}
+    }
+
+    def add_object(object_name, cgx_dict, site_id=None, element_id=None):
+        object_id = cgx_dict.get('id')
+        if object_id is None:
+            return
+        index["objects"].setdefault(object_name, {})[object_id] = cgx_dict
+        index["parents"][object_id] = {
+            "site_id": site_id,
+            "element_id": element_id
+        }
+        for tag in extract_tags(cgx_dict):
+            index["tags"].setdefault(tag, {}).setdefault(object_name, set()).add(object_id)
+
+    for site in inventory.get("sites", []):
+        add_object('sites', site)
+
+    element_site_lookup = {}
+    for element in inventory.get("elements", []):
+        element_site_lookup[element.get('id')] = element.get('site_id')
+        add_object('elements', element, site_id=element.get('site_id'))
+
+    for element_id, interfaces_list in inventory.get("interfaces", {}).items():
+        for interface in interfaces_list:
+            add_object('interfaces', interface, site_id=element_site_lookup.get(element_id), element_id=element_id)
+
+    for circuitcatagory in inventory.get("circuitcatagories", []):
+        add_object('circuitcatagories', circuitcatagory)
+
+    return index
+
+
+def query_tag_index(index, the_tag, object_name, site_ids=None, element_ids=None):
+    """
+    Look up objects carrying a tag in a tag index.
+    :param index: Index dict, as returned by build_tag_index()
+    :param the_tag: Tag to look up
+    :param object_name: Object to look up (one of SUPPORTED_OBJECTS)
+    :param site_ids: Optional set of site IDs. If set, only objects whose parent site is in the set are returned.
+    :param element_ids: Optional set of element IDs. If set, only objects whose parent element is in the set are
+                        returned.
+    :return: Set of object IDs.
+    """
+    object_ids = index["tags"].get(the_tag, {}).get(object_name, set())
+
+    if site_ids is not None:
+        object_ids = set([object_id for object_id in object_ids
+                          if index["parents"][object_id]["site_id"] in site_ids])
+    if element_ids is not None:
+        object_ids = set([object_id for object_id in object_ids
+                          if index["parents"][object_id]["element_id"] in element_ids])
+
+    return set(object_ids)
+
 
-        # finish after iteration.
-        pbar.finish()
+def report_tags(index, the_tag, object_name, key_name, compiled_pattern,
+                site_key_name=None, site_compiled_pattern=None,
+                element_key_name=None, element_compiled_pattern=None, output=None,
+                site_filters=None, element_filters=None):
+    """
+    Read-only report of objects carrying a tag. Makes no API calls, works from a tag index.
+    :param index: Index dict, as returned by build_tag_index()
+    :param the_tag: Tag to report on
+    :param object_name: Object to look up (one of SUPPORTED_OBJECTS)
+    :param key_name: Name of key to use in object for matching
+    :param compiled_pattern: Compiled regex to match value of key_name cast to text
+    :param site_key_name: Optional name of key to use in SITE object for matching ('interfaces' only)
+    :param site_compiled_pattern: Optional compiled regex to match value of site_key_name cast to text
+    :param element_key_name: Optional name of key to use in ELEMENT object for matching ('interfaces' only)
+    :param element_compiled_pattern: Optional compiled regex to match value of element_key_name cast to text
+    :param output: Optional filename to save .csv report to, otherwise will be printed to STDOUT.
+    :param site_filters: Optional list of (key path, compiled regex) tuples. Sites must also match all of these.
+    :param element_filters: Optional list of (key path, compiled regex) tuples. Elements must also match all of these.
+    :return: Number of objects matched.
+    """
+    if object_name.lower() not in SUPPORTED_OBJECTS:
+        throw_error("Object {0} not a supported object in this version.".format(object_name))
+
+    site_objects = index["objects"].get('sites', {})
+    element_objects = index["objects"].get('elements', {})
+
+    site_ids = None
+    element_ids = None
+    if object_name == 'interfaces':
+        if site_compiled_pattern is not None:
+            site_ids = set([site_id for site_id, site in site_objects.items()
+                            if check_match(site_key_name, site_compiled_pattern, site)[0]])
+        if element_compiled_pattern is not None:
+            element_ids = set([element_id for element_id, element in element_objects.items()
+                               if check_match(element_key_name, element_compiled_pattern, element)[0]])
+        if site_filters or element_filters:
+            filter_site_ids, filter_element_ids = join_parent_filters(list(site_objects.values()),
+                                                                      list(element_objects.values()),
+                                                                      site_filters, element_filters)
+            site_ids = filter_site_ids if site_ids is None else site_ids & filter_site_ids
+            element_ids = filter_element_ids if element_ids is None else element_ids & filter_element_ids
+
+    output_results = [["Tag", "Object", "Site Name", "Element Name", "Object Name", "Object Key", "Object Key Value",
+                       "Object ID"]]
+
+    for object_id in query_tag_index(index, the_tag, object_name, site_ids=site_ids, element_ids=element_ids):
+        cgx_dict = index["objects"][object_name][object_id]
+        match_status, entry_name, key_val = check_match(key_name, compiled_pattern, cgx_dict)
+        if not match_status:
+            continue
+
+        parents = index["parents"][object_id]
+        site_name = site_objects.get(parents["site_id"], {}).get("name")
+        element_name = element_objects.get(parents["element_id"], {}).get("name")
+
+        output_results.append([the_tag, object_name, site_name, element_name, entry_name, key_name, key_val,
+                               object_id])
+
+    # stable output order.
+    output_results[1:] = sorted(output_results[1:], key=lambda row: [text_type(col) for col in row[2:5]])
+    match_count = len(output_results) - 1
 
     # was output to file specified?
     if output is None:
         # print
         print(tabulate(output_results, headers="firstrow", tablefmt="simple"))
+        print("{0} '{1}' object(s) with tag '{2}'.".format(match_count, object_name, the_tag))
     else:
         with open(output, "w") as csv_output:
             writer = csv.writer(csv_output, quoting=csv.QUOTE_ALL)
             writer.writerows(output_results)
 
+    return match_count
+
+
+def export_snapshot(sdk, filename, shard=None, timer=None):
+    """
+    Save everything the parse functions use (sites, elements, interfaces and circuit catagories) to a snapshot file,
+    for offline use with --from-snapshot.
+    :param sdk: Authenticated CloudGenix SDK constructor.
+    :param filename: Name of snapshot file. Gzip compressed if it ends in '.gz'.
+    :param shard: Optional tuple of shard index (1-based) and shard count. Only interfaces of elements in this shard
+                  are saved, and the shard is recorded in the snapshot.
+    :param timer: Optional RequestTimer to apply timeouts/hedging to interface queries.
+    :return: No return
+    """
+    print("Exporting snapshot..")
+    inventory = fetch_inventory(sdk, 'interfaces', shard=shard, timer=timer)
+    inventory["circuitcatagories"] = extract_items(sdk.get.waninterfacelabels(), 'circuitcatagories')
+
+    snapshot = {
+        "snapshot_version": SNAPSHOT_VERSION,
+        "created": time.time(),
+        "tenant_id": sdk.tenant_id,
+        "shard": None if shard is None else "{0}/{1}".format(shard[0], shard[1]),
+        "inventory": inventory
+    }
+    snapshot_text = json.dumps(snapshot, separators=(",", ":"))
+
+    if filename.endswith(".gz"):
+        with gzip.open(filename, "wb") as snapshot_output:
+            snapshot_output.write(snapshot_text.encode('utf-8'))
+    else:
+        with open(filename, "w") as snapshot_output:
+            snapshot_output.write(snapshot_text)
+
+    print("Saved {0} sites, {1} elements, {2} interfaces, {3} circuit catagories to '{4}'."
+          "".format(len(inventory["sites"]), len(inventory["elements"]),
+                    sum([len(interfaces_list) for interfaces_list in inventory["interfaces"].values()]),
+                    len(inventory["circuitcatagories"]), filename))
+
+    # elements without interfaces in the snapshot are reported as not found when it is used.
+    missing_count = len([element for element in inventory["elements"]
+                         if element.get('site_id') not in [None, "1"] and
+                         element.get('id') not in inventory["interfaces"]])
+    if missing_count:
+        throw_warning("Interfaces of {0} element(s) are not in the snapshot{1}. They will be reported as not found "
+                      "with --from-snapshot.".format(missing_count,
+                                                     "" if shard is None else " (shard {0})".format(snapshot["shard"])))
+
+
+def load_snapshot(filename):
+    """
+    Load a snapshot file written by export_snapshot().
+    :param filename: Name of snapshot file. Gzip compression is detected automatically.
+    :return: Snapshot dict with 'tenant_id' and 'inventory'.
+    """
+    with open(filename, "rb") as snapshot_input:
+        snapshot_bytes = snapshot_input.read()
+
+    if snapshot_bytes[:2] == b"\x1f\x8b":
+        snapshot_bytes = gzip.GzipFile(fileobj=io.BytesIO(snapshot_bytes)).read()
+
+    try:
+        snapshot = json.loads(snapshot_bytes.decode('utf-8'))
+    except ValueError as e:
+        throw_error("Unable to read snapshot '{0}': {1}".format(filename, e))
+        return None
+
+    if not isinstance(snapshot, dict) or snapshot.get("snapshot_version") != SNAPSHOT_VERSION:
+        throw_error("'{0}' is not a version {1} snapshot.".format(filename, SNAPSHOT_VERSION))
+
+    return snapshot
+
+
+class SnapshotResponse(object):
+    """
+    Minimal stand-in for a CloudGenix Extended Requests.Response object, for snapshot data.
+    """
+
+    def __init__(self, cgx_content, status_code=200):
+        self.cgx_content = cgx_content
+        self.status_code = status_code
+        self.cgx_status = 200 <= status_code < 300
+
+    def __str__(self):
+        return "SNAPSHOT RESPONSE: {0}\nRESPONSE DATA:\n{1}".format(self.status_code,
+                                                                   json.dumps(self.cgx_content, indent=4))
+
+
+class SnapshotGet(object):
+    """
+    Serves the GET calls the parse functions use from a snapshot inventory.
+    """
+
+    def __init__(self, inventory):
+        self.inventory = inventory
+        self.site_lookup = dict([(site.get('id'), site) for site in inventory.get("sites", [])])
+        self.element_lookup = dict([(element.get('id'), element) for element in inventory.get("elements", [])])
+        self.circuitcatagory_lookup = dict([(circuitcatagory.get('id'), circuitcatagory)
+                                            for circuitcatagory in inventory.get("circuitcatagories", [])])
+
+    @staticmethod
+    def items_or_object(items_list, lookup, object_id):
+        """
+        Build a list response, or a single object response (404 if not in snapshot) if object_id is set.
+        """
+        if object_id is None:
+            return SnapshotResponse({"items": items_list})
+        cgx_dict = lookup.get(object_id)
+        if cgx_dict is None:
+            return SnapshotResponse({"_error": [{"code": "NOT_FOUND"}]}, 404)
+        return SnapshotResponse(cgx_dict)
+
+    def sites(self, site_id=None):
+        return self.items_or_object(self.inventory.get("sites", []), self.site_lookup, site_id)
+
+    def elements(self, element_id=None):
+        return self.items_or_object(self.inventory.get("elements", []), self.element_lookup, element_id)
+
+    def interfaces(self, site_id, element_id, interface_id=None):
+        if element_id not in self.inventory.get("interfaces", {}):
+            # not exported (other shard, or the query failed on export), don't pretend it has no interfaces.
+            return SnapshotResponse({"_error": [{"code": "NOT_FOUND",
+                                                 "message": "Interfaces for element {0} are not in the snapshot."
+                                                            "".format(element_id)}]}, 404)
+        interfaces_list = self.inventory["interfaces"][element_id]
+        interface_lookup = dict([(interface.get('id'), interface) for interface in interfaces_list])
+        return self.items_or_object(interfaces_list, interface_lookup, interface_id)
+
+    def waninterfacelabels(self, waninterfacelabel_id=None):
+        return self.items_or_object(self.inventory.get("circuitcatagories", []), self.circuitcatagory_lookup,
+                                    waninterfacelabel_id)
+
+
+class SnapshotAPI(object):
+    """
+    Read-only, offline stand-in for an authenticated cloudgenix.API constructor, backed by a snapshot. Only supports
+    the GETs used by this script, so it can only be used for --simulate and --report.
+    """
+
+    def __init__(self, snapshot):
+        self.tenant_id = snapshot.get("tenant_id")
+        self.get = SnapshotGet(snapshot.get("inventory", {}))
+
+
+def save_session_cache(sdk, filename, user_email=None, ttl=DEFAULT_SESSION_CACHE_TTL):
+    """
+    Save an authenticated SDK session to a cache file only readable by the current user.
+    :param sdk: Authenticated CloudGenix SDK constructor.
+    :param filename: Name of session cache file.
+    :param user_email: Optional email the session was logged in with.
+    :param ttl: Seconds the cached session can be reused for.
+    :return: No return
+    """
+    session = sdk.expose_session()
+
+    session_cache = {
+        "controller_orig": sdk.controller_orig,
+        "controller": sdk.controller,
+        "controller_region": sdk.controller_region,
+        "email": user_email,
+        "expires": time.time() + ttl,
+        "x_auth_token": session.headers.get('X-Auth-Token'),
+        "cookies": [{
+            "name": cookie.name,
+            "value": cookie.value,
+            "domain": cookie.domain,
+            "path": cookie.path,
+            "secure": cookie.secure,
+            "expires": cookie.expires
+        } for cookie in session.cookies]
+    }
+
+    filename = os.path.expanduser(filename)
+    try:
+        # create with owner only permissions, and fix up permissions on an existing file.
+        cache_fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        if os.name == 'posix':
+            os.chmod(filename, 0o600)
+        with os.fdopen(cache_fd, "w") as cache_output:
+            json.dump(session_cache, cache_output)
+    except (IOError, OSError) as e:
+        throw_warning("Unable to save session cache '{0}': {1}".format(filename, e))
+
+
+def load_session_cache(sdk, filename, user_email=None):
+    """
+    Try to reuse a cached session. The session is checked with the controller before use.
+    :param sdk: Unauthenticated CloudGenix SDK constructor.
+    :param filename: Name of session cache file.
+    :param user_email: Optional email to log in with. Cached sessions for other emails are not reused.
+    :return: Bool, True if sdk is now authenticated.
+    """
+    filename = os.path.expanduser(filename)
+    if not os.path.isfile(filename):
+        return False
+
+    if os.name == 'posix' and os.stat(filename).st_mode & 0o077:
+        throw_warning("Session cache '{0}' is readable by other users, not using it.".format(filename))
+        return False
+
+    try:
+        with open(filename, "r") as cache_input:
+            session_cache = json.load(cache_input)
+    except (IOError, OSError, ValueError) as e:
+        throw_warning("Unable to read session cache '{0}': {1}".format(filename, e))
+        return False
+
+    if session_cache.get("controller_orig") != sdk.controller_orig:
+        return False
+    if user_email is not None and session_cache.get("email") != user_email:
+        return False
+    if session_cache.get("expires", 0) < time.time():
+        return False
+
+    # restore session state, including region redirect.
+    session = sdk.expose_session()
+    sdk.controller = session_cache.get("controller", sdk.controller)
+    sdk.controller_region = session_cache.get("controller_region")
+    if session_cache.get("x_auth_token"):
+        sdk.add_headers({'X-Auth-Token': session_cache["x_auth_token"]})
+    for cookie in session_cache.get("cookies", []):
+        session.cookies.set(cookie["name"], cookie["value"], domain=cookie["domain"], path=cookie["path"],
+                            secure=cookie["secure"], expires=cookie["expires"])
+
+    # make sure controller still accepts the session.
+    if sdk.interactive.interactive_update_profile_vars() and sdk.tenant_id \
+            and sdk.interactive.interactive_tenant_update_vars():
+        return True
+
+    # rejected, reset to a clean unauthenticated state.
+    session.cookies.clear()
+    if session_cache.get("x_auth_token"):
+        sdk.remove_header('X-Auth-Token')
+    sdk.controller = sdk.controller_orig
+    sdk.controller_region = None
+    sdk.tenant_id = None
+    return False
+
 
 ####
 #
@@ -748,15 +2356,29 @@ def go():
     #
     ####
 
-    action_group = parser.add_argument_group('Action', 'Add or Remove Tags')
+    action_group = parser.add_argument_group('Action', 'Add, Remove, Sync, Replace or Report Tags')
     action = action_group.add_mutually_exclusive_group(required=True)
     action.add_argument('--add', '-A', action='store_true', default=False)
     action.add_argument('--remove', '-R', action='store_true', default=False)
+    action.add_argument('--sync', action='store_true', default=False,
+                        help="Converge tag membership in one pass: add the tag to matching objects, and remove it "
+                             "from non-matching objects. Only objects whose membership changes are written.")
+    action.add_argument('--replace', type=text_type, nargs=2, metavar=('OLD', 'NEW'), default=None,
+                        help="Replace tag OLD with tag NEW on objects that currently carry OLD, writing each object "
+                             "once. --tag is not used, --pattern defaults to '.*'.")
+    action.add_argument('--replace-file', type=text_type, default=None,
+                        help="Like --replace, but read 'old tag,new tag' rows from a .csv file.")
+    action.add_argument('--export-snapshot', type=text_type, default=None, metavar='FILE',
+                        help="Save sites, elements, interfaces and circuit catagories to a snapshot file (gzip if "
+                             "FILE ends in '.gz') for offline use with --from-snapshot. Makes no changes.")
+    action.add_argument('--report', action='store_true', default=False,
+                        help="Read-only. Report objects that carry the tag, using --pattern/--key and the "
+                             "'interfaces' site/element options to narrow the results. Makes no changes.")
     action_group.add_argument('--simulate', '-S', action='store_true', default=False,
                               help="Simulate and display prospective changes. Don't make any actual modifications.")
-    action_group.add_argument('--tag', '-T', type=text_type, required=True,
-                              help='Tag to add or remove from objects.')
-    action_group.add_argument('--object', '-O', type=text_type, required=True,
+    action_group.add_argument('--tag', '-T', type=text_type, default=None,
+                              help="Tag to add or remove from objects. Required except for --replace/--replace-file.")
+    action_group.add_argument('--object', '-O', type=text_type, default=None,
                               help="Object to add/remove tags from. One of {0}.".format(", ".join(SUPPORTED_OBJECTS)))
 
     action_group.add_argument('--interfaces-site-key', '-SK', type=text_type, default='name',
@@ -766,16 +2388,59 @@ def go():
     action_group.add_argument('--key', '-K', type=text_type, default='name',
                               help="Key in object to use for match. Default 'name'.")
 
-    action_group.add_argument('--interfaces-site-pattern', '-SP', type=text_type, default='.*',
-                              help="REGEX Pattern to match Site Object with for inclusion ('interfaces' only)."
-                                   " Default '.*'")
-    action_group.add_argument('--interfaces-element-pattern', '-EP', type=text_type, default='.*',
-                              help="REGEX Pattern to match Element Object with for inclusion ('interfaces' only)."
-                                   " Default '.*'")
-    action_group.add_argument('--pattern', '-P', type=text_type, required=True,
-                              help="REGEX Pattern to match Object Key value with.")
+    action_group.add_argument('--interfaces-site-pattern', '-SP', type=text_type, default=None,
+                              help="REGEX Pattern to match Site Object with for inclusion ('interfaces' only). "
+                                   "Uses --match-type like --pattern. Default all Sites.")
+    action_group.add_argument('--interfaces-element-pattern', '-EP', type=text_type, default=None,
+                              help="REGEX Pattern to match Element Object with for inclusion ('interfaces' only). "
+                                   "Uses --match-type like --pattern. Default all Elements.")
+    action_group.add_argument('--interfaces-site-filter', '-SF', type=text_type, action='append', default=[],
+                              help="Additional 'KEY=PATTERN' REGEX filter on Site objects ('interfaces' only). KEY "
+                                   "may be a dotted path (ex. 'address.country'), list values such as 'tags' match "
+                                   "per entry. Can be repeated, all must match.")
+    action_group.add_argument('--interfaces-element-filter', '-EF', type=text_type, action='append', default=[],
+                              help="Additional 'KEY=PATTERN' REGEX filter on Element objects ('interfaces' only). "
+                                   "Same format as --interfaces-site-filter. Can be repeated, all must match.")
+    action_group.add_argument('--pattern', '-P', type=text_type, default=None,
+                              help="REGEX Pattern to match Object Key value with. Required for "
+                                   "--add/--remove/--sync, default '.*' for --replace/--report/--ids.")
+    action_group.add_argument('--match-type', type=text_type, default='regex', choices=MATCH_TYPES,
+                              help="How given --pattern/-SP/-EP (and match file) values are matched. Defaults "
+                                   "that match everything are not affected. 'regex' automatically uses a faster "
+                                   "literal matcher for plain text patterns. Default 'regex'.")
+    action_group.add_argument('--match-file', type=text_type, default=None,
+                              help="Match Object Key value against a file of values, one per line, instead of "
+                                   "--pattern. Exact match unless --match-type is 'prefix' or 'glob'.")
+    action_group.add_argument('--interfaces-site-match-file', type=text_type, default=None,
+                              help="Match Site Object with a file of values instead of --interfaces-site-pattern "
+                                   "('interfaces' only). Uses --match-type like --match-file.")
+    action_group.add_argument('--interfaces-element-match-file', type=text_type, default=None,
+                              help="Match Element Object with a file of values instead of "
+                                   "--interfaces-element-pattern ('interfaces' only). Uses --match-type like "
+                                   "--match-file.")
+    action_group.add_argument('--ids', type=text_type, default=None,
+                              help="Targeted mode. Only fetch and work on the objects listed in this .csv file "
+                                   "(header row with 'id', plus 'site_id' and 'element_id' for 'interfaces'), "
+                                   "instead of scanning the tenant.")
+    action_group.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                              help="Concurrent API workers for --ids mode. Default {0}.".format(DEFAULT_WORKERS))
     action_group.add_argument('--output', type=text_type, default=None,
                               help="Output to filename. If not specified, will print output on STDOUT.")
+    action_group.add_argument('--retries', type=int, default=DEFAULT_RETRIES,
+                              help="Retry rounds for failed tag changes, run at the end. Default "
+                                   "{0}.".format(DEFAULT_RETRIES))
+    action_group.add_argument('--failures', type=text_type, default=None,
+                              help="Save tag changes that still fail after retries to this .csv file (always "
+                                   "written, header only if none failed). Re-run with '--ids <file>' to retry only "
+                                   "those objects. Default '{0}' if any fail."
+                                   "".format(DEFAULT_FAILURES.format("<timestamp>")))
+    action_group.add_argument('--progress-json', type=text_type, default=None, metavar='FILE',
+                              help="Write newline delimited JSON progress events (objects, PUTs, errors, ETA) to "
+                                   "FILE, or '-' for STDERR. Works without a terminal.")
+    action_group.add_argument('--shard', type=text_type, default=None,
+                              help="Only process shard 'i/N' of the objects (ex. '1/4'). Objects are split "
+                                   "deterministically by ID, so N runs with i=1..N cover every object exactly once. "
+                                   "Combine shard outputs with 'do_tags_merge'.")
 
     ####
     #
@@ -789,6 +2454,23 @@ def go():
                                   help="Controller URI, ex. https://api.elcapitan.cloudgenix.com",
                                   default=None)
 
+    controller_group.add_argument("--from-snapshot", help="Work offline from a snapshot file written by "
+                                                          "--export-snapshot instead of the API. No login is "
+                                                          "needed, implies --simulate.",
+                                  default=None)
+    controller_group.add_argument("--timeout", help="Seconds to wait for each object query before skipping it. "
+                                                    "Default no timeout.",
+                                  type=float, default=None)
+    controller_group.add_argument("--hedge", help="Send a duplicate object query when one takes longer than the "
+                                                  "--hedge-percentile latency seen so far, use the first response.",
+                                  action='store_true', default=False)
+    controller_group.add_argument("--hedge-percentile", help="Latency percentile for --hedge. Default "
+                                                             "{0}.".format(DEFAULT_HEDGE_PERCENTILE),
+                                  type=float, default=DEFAULT_HEDGE_PERCENTILE)
+    controller_group.add_argument("--latency-stats", help="Report query latency stats on STDERR at the end of the "
+                                                          "run. Enabled by --timeout/--hedge.",
+                                  action='store_true', default=False)
+
     login_group = parser.add_argument_group('Login', 'These options allow skipping of interactive login')
     login_group.add_argument("--email", "-E", help="Use this email as User Name instead of cloudgenix_settings.py "
                                                    "or prompting",
@@ -801,6 +2483,13 @@ def go():
                              default=False)
     login_group.add_argument("--noregion", "-NR", help="Ignore Region-based redirection.",
                              dest='ignore_region', action='store_true', default=False)
+    login_group.add_argument("--session-cache", help="Reuse the email/password login session across runs. Cached "
+                                                     "in this file (owner read/write only), default "
+                                                     "'{0}'.".format(DEFAULT_SESSION_CACHE),
+                             nargs='?', const=DEFAULT_SESSION_CACHE, default=None)
+    login_group.add_argument("--session-cache-ttl", help="Seconds a cached session is reused before logging in "
+                                                         "again. Default {0}.".format(DEFAULT_SESSION_CACHE_TTL),
+                             type=int, default=DEFAULT_SESSION_CACHE_TTL)
 
     debug_group = parser.add_argument_group('Debug', 'These options enable debugging output')
     debug_group.add_argument("--sdkdebug", "-D", help="Enable SDK Debug output, levels 0-2", type=int,
@@ -808,64 +2497,147 @@ def go():
 
     args = vars(parser.parse_args())
 
-    sdk_debuglevel = args["sdkdebug"]
+    replace = args['replace'] is not None or args['replace_file'] is not None
+
+    export = args['export_snapshot'] is not None
+
+    if args['object'] is None and not export:
+        parser.error("argument --object/-O is required.")
+    elif args['object'] is not None:
+        args['object'] = args['object'].lower()
+
+    if args['tag'] is None and not replace and not export:
+        parser.error("argument --tag/-T is required for --add/--remove/--sync/--report.")
+
+    if export and args['from_snapshot']:
+        parser.error("argument --export-snapshot can not be used with --from-snapshot.")
+
+    if args['from_snapshot'] and not args['simulate'] and not args['report']:
+        # snapshot can't be written to.
+        sys.stderr.write("NOTE: --from-snapshot is offline, changes will be simulated.\n")
+        args['simulate'] = True
+
+    if args['ids'] and args['report']:
+        parser.error("argument --ids can not be used with --report.")
+
+    if args['pattern'] is None and not (args['report'] or replace or export or args['match_file'] or args['ids']):
+        parser.error("argument --pattern/-P is required for --add/--remove/--sync.")
+
+    # replace works on a mapping of old tag -> new tag instead of a single tag.
+    if args['replace'] is not None:
+        args['tag'] = {args['replace'][0]: args['replace'][1]}
+    elif args['replace_file'] is not None:
+        args['tag'] = load_tag_map(args['replace_file'])
+
+    # validate shard, filters and ID files before doing any login work.
+    id_rows = None
+    if args['ids'] and not export:
+        id_rows = load_id_rows(args['ids'], args['object'].lower())
+
+    shard = None
+    if args['shard']:
+        shard = parse_shard(args['shard'])
+
+    site_filters = [parse_filter(filter_string) for filter_string in args['interfaces_site_filter']]
+    element_filters = [parse_filter(filter_string) for filter_string in args['interfaces_element_filter']]
 
-    # Build SDK Constructor
-    if args['controller'] and args['insecure']:
-        sdk = cloudgenix.API(controller=args['controller'], ssl_verify=False)
-    elif args['controller']:
-        sdk = cloudgenix.API(controller=args['controller'])
-    elif args['insecure']:
-        sdk = cloudgenix.API(ssl_verify=False)
+    # build matchers once. Match files replace the corresponding pattern. --match-type only applies to given
+    # patterns, the default for a missing one is always the '.*' regex (match everything).
+    if args['match_file']:
+        compiled_pattern = load_match_file(args['match_file'], args['match_type'])
+    elif args['pattern'] is not None:
+        compiled_pattern = compile_matcher(args['pattern'], args['match_type'])
     else:
-        sdk = cloudgenix.API()
-
-    # check for region ignore
-    if args['ignore_region']:
-        sdk.ignore_region = True
-
-    # SDK debug, default = 0
-    # 0 = logger handlers removed, critical only
-    # 1 = logger info messages
-    # 2 = logger debug messages.
-
-    if sdk_debuglevel == 1:
-        # CG SDK info
-        sdk.set_debug(1)
-    elif sdk_debuglevel >= 2:
-        # CG SDK debug
-        sdk.set_debug(2)
-
-    # login logic. Use cmdline if set, use AUTH_TOKEN next, finally user/pass from config file, then prompt.
-    # figure out user
-    if args["email"]:
-        user_email = args["email"]
-    elif CLOUDGENIX_USER:
-        user_email = CLOUDGENIX_USER
+        compiled_pattern = compile_matcher('.*')
+
+    if args['interfaces_site_match_file']:
+        site_compiled_pattern = load_match_file(args['interfaces_site_match_file'], args['match_type'])
+    elif args['interfaces_site_pattern'] is not None:
+        site_compiled_pattern = compile_matcher(args['interfaces_site_pattern'], args['match_type'])
     else:
-        user_email = None
+        site_compiled_pattern = compile_matcher('.*')
 
-    # figure out password
-    if args["password"]:
-        user_password = args["password"]
-    elif CLOUDGENIX_PASSWORD:
-        user_password = CLOUDGENIX_PASSWORD
+    if args['interfaces_element_match_file']:
+        element_compiled_pattern = load_match_file(args['interfaces_element_match_file'], args['match_type'])
+    elif args['interfaces_element_pattern'] is not None:
+        element_compiled_pattern = compile_matcher(args['interfaces_element_pattern'], args['match_type'])
     else:
-        user_password = None
+        element_compiled_pattern = compile_matcher('.*')
 
-    # check for token
-    if CLOUDGENIX_AUTH_TOKEN and not args["email"] and not args["password"]:
-        sdk.interactive.use_token(CLOUDGENIX_AUTH_TOKEN)
-        if sdk.tenant_id is None:
-            raise CloudGenixTaggerError("AUTH_TOKEN login failure, please check token.")
+    if args['from_snapshot']:
+        # offline, serve API GETs from the snapshot. No login needed.
+        snapshot = load_snapshot(args['from_snapshot'])
+        if snapshot.get("shard"):
+            sys.stderr.write("NOTE: '{0}' is shard {1}, only interfaces of elements in that shard are available.\n"
+                             "".format(args['from_snapshot'], snapshot["shard"]))
+        sdk = SnapshotAPI(snapshot)
 
     else:
-        while sdk.tenant_id is None:
-            sdk.interactive.login(user_email, user_password)
-            # clear after one failed login, force relogin.
-            if not sdk.tenant_id:
-                user_email = None
-                user_password = None
+        sdk_debuglevel = args["sdkdebug"]
+
+        # Build SDK Constructor
+        if args['controller'] and args['insecure']:
+            sdk = cloudgenix.API(controller=args['controller'], ssl_verify=False)
+        elif args['controller']:
+            sdk = cloudgenix.API(controller=args['controller'])
+        elif args['insecure']:
+            sdk = cloudgenix.API(ssl_verify=False)
+        else:
+            sdk = cloudgenix.API()
+
+        # check for region ignore
+        if args['ignore_region']:
+            sdk.ignore_region = True
+
+        # SDK debug, default = 0
+        # 0 = logger handlers removed, critical only
+        # 1 = logger info messages
+        # 2 = logger debug messages.
+
+        if sdk_debuglevel == 1:
+            # CG SDK info
+            sdk.set_debug(1)
+        elif sdk_debuglevel >= 2:
+            # CG SDK debug
+            sdk.set_debug(2)
+
+        # login logic. Use cmdline if set, use AUTH_TOKEN next, finally user/pass from config file, then prompt.
+        # figure out user
+        if args["email"]:
+            user_email = args["email"]
+        elif CLOUDGENIX_USER:
+            user_email = CLOUDGENIX_USER
+        else:
+            user_email = None
+
+        # figure out password
+        if args["password"]:
+            user_password = args["password"]
+        elif CLOUDGENIX_PASSWORD:
+            user_password = CLOUDGENIX_PASSWORD
+        else:
+            user_password = None
+
+        # check for token
+        if CLOUDGENIX_AUTH_TOKEN and not args["email"] and not args["password"]:
+            sdk.interactive.use_token(CLOUDGENIX_AUTH_TOKEN)
+            if sdk.tenant_id is None:
+                raise CloudGenixTaggerError("AUTH_TOKEN login failure, please check token.")
+
+        elif args['session_cache'] and load_session_cache(sdk, args['session_cache'], user_email):
+            # reused cached session, no login needed.
+            pass
+
+        else:
+            while sdk.tenant_id is None:
+                sdk.interactive.login(user_email, user_password)
+                # clear after one failed login, force relogin.
+                if not sdk.tenant_id:
+                    user_email = None
+                    user_password = None
+
+            if args['session_cache']:
+                save_session_cache(sdk, args['session_cache'], sdk.email, args['session_cache_ttl'])
 
     ####
     #
@@ -878,17 +2650,67 @@ def go():
         args_action = 'add'
     elif args['remove']:
         args_action = 'remove'
+    elif args['sync']:
+        args_action = 'sync'
+    elif replace:
+        args_action = 'replace'
+
+    # machine readable progress stream.
+    progress_output = None
+    if args['progress_json'] == '-':
+        progress_output = sys.stderr
+    elif args['progress_json']:
+        progress_output = open(args['progress_json'], "w")
+
+    # timeouts/hedging/stats for object queries.
+    timer = None
+    if args['timeout'] is not None or args['hedge'] or args['latency_stats']:
+        timer = RequestTimer(args['timeout'], args['hedge'], args['hedge_percentile'])
+
+    # export is read-only, saves a snapshot for offline use.
+    if export:
+        export_snapshot(sdk, args['export_snapshot'], shard=shard, timer=timer)
+
+    # report is read-only, and works from a tag index.
+    elif args['report']:
+        if args['object'].lower() != 'interfaces':
+            site_compiled_pattern = None
+            element_compiled_pattern = None
+
+        inventory = fetch_inventory(sdk, args['object'], args['interfaces_site_key'], site_compiled_pattern,
+                                    args['interfaces_element_key'], element_compiled_pattern, shard=shard,
+                                    site_filters=site_filters, element_filters=element_filters, timer=timer)
+        report_tags(build_tag_index(inventory), args['tag'], args['object'], args['key'],
+                    compiled_pattern, args['interfaces_site_key'], site_compiled_pattern,
+                    args['interfaces_element_key'], element_compiled_pattern, output=args['output'],
+                    site_filters=site_filters, element_filters=element_filters)
+
+    # targeted mode, work straight from ID list.
+    elif id_rows is not None:
+        parse_targeted_objects(sdk, args['tag'], args_action, args['simulate'], args['object'].lower(), args['key'],
+                               compiled_pattern, id_rows, output=args['output'], shard=shard,
+                               workers=args['workers'], timer=timer, retries=args['retries'],
+                               failures_output=args['failures'], progress_output=progress_output)
 
     # interfaces requires hierarchical matching.
-    if args['object'].lower() == 'interfaces':
+    elif args['object'].lower() == 'interfaces':
         parse_interfaces(sdk, args['tag'], args_action, args['simulate'], args['object'], args['key'],
-                         re.compile(args['pattern']), args['interfaces_site_key'],
-                         re.compile(args['interfaces_site_pattern']), args['interfaces_element_key'],
-                         re.compile(args['interfaces_element_pattern']),
-                         output=args['output'])
+                         compiled_pattern, args['interfaces_site_key'],
+                         site_compiled_pattern, args['interfaces_element_key'],
+                         element_compiled_pattern,
+                         output=args['output'], shard=shard, site_filters=site_filters,
+                         element_filters=element_filters, timer=timer, retries=args['retries'],
+                         failures_output=args['failures'], progress_output=progress_output)
     else:
         parse_basic_objects(sdk, args['tag'], args_action, args['simulate'], args['object'], args['key'],
-                            re.compile(args['pattern']), output=args['output'])
+                            compiled_pattern, output=args['output'], shard=shard, retries=args['retries'],
+                            failures_output=args['failures'], progress_output=progress_output)
+
+    if timer is not None:
+        timer.report()
+
+    if progress_output is not None and progress_output is not sys.stderr:
+        progress_output.close()
 
     ####
     #
@@ -897,5 +2719,24 @@ def go():
     ####
 
 
+def merge_go():
+    """
+    Stub script entry point for merging shard outputs. Does not need API access.
+    :return: No return
+    """
+
+    # Parse arguments
+    parser = argparse.ArgumentParser(description="{0} Shard Merge ({1})".format(GLOBAL_MY_SCRIPT_NAME,
+                                                                               GLOBAL_MY_SCRIPT_VERSION))
+    parser.add_argument('inputs', type=text_type, nargs='+',
+                        help="Shard output .csv files to merge (written with --shard and --output).")
+    parser.add_argument('--output', type=text_type, default=None,
+                        help="Output to filename. If not specified, will print output on STDOUT.")
+
+    args = vars(parser.parse_args())
+
+    merge_outputs(args['inputs'], output=args['output'])
+
+
 if __name__ == "__main__":
     go()
@@ -0,0 +1,6 @@
+#!/usr/bin/env python
+from cloudgenix_tagger import merge_go
+
+
+if __name__ == "__main__":
+    merge_go()
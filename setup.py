@@ -21,7 +21,8 @@ setup(name='cloudgenix_tagger',
       packages=['cloudgenix_tagger'],
       entry_points={
             'console_scripts': [
-                  'do_tags = cloudgenix_tagger:go'
+                  'do_tags = cloudgenix_tagger:go',
+                  'do_tags_merge = cloudgenix_tagger:merge_go'
                   ]
       },
       classifiers=[